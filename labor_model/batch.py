@@ -1,59 +1,523 @@
-from itertools import groupby
+from dataclasses import dataclass
+from functools import partial
+import gc
+import hashlib
+import json
 import logging
+import math
+from multiprocessing import Pool, get_all_start_methods, get_context
+from pathlib import Path
 from pprint import pprint
-from mesa.batchrunner import batch_run
+from tempfile import TemporaryDirectory
+from typing import Iterator
 
+import numpy as np
+from tqdm.auto import tqdm
+
+from labor_model.checkpoint import load_checkpoint, save_checkpoint
 from labor_model.config import Settings
-from labor_model.model import LaborModel
+from labor_model.early_stop import DIVERGED, MAX_STEPS, EarlyStop
+from labor_model.model import CONSTRUCTION_SETTINGS, LaborModel
 from labor_model.local_logging import logger
+from labor_model.results_store import ResultsStore, StoredRunGroup
+
+
+@dataclass
+class BatchRun:
+    run_id: int
+    iteration: int
+    num_employees: int
+    num_companies: int
+    # Only the fields that differ from the batch's base settings, so tasks stay small
+    setting_overrides: dict
+    fingerprint: str
+    # A child of the batch's root SeedSequence, spawn key (run_id,)
+    seed: np.random.SeedSequence
+    # Steps shared by every variant of an iteration, simulated once with the
+    # base settings and forked from a checkpoint
+    warmup_steps: int = 0
+    checkpoint: Path | None = None
+    # Send every step's collector values back with the summary. Only batches
+    # with a ResultsStore need them, the others keep just the final row.
+    keep_history: bool = False
+
+
+RUN_PARAMETER_NAMES = [
+    "RunId",
+    "iteration",
+    "num_employees",
+    "num_companies",
+    "setting_overrides",
+    "fingerprint",
+    "seed_entropy",
+    "warmup_steps",
+]
+# How a run ended, stored next to its parameters
+RUN_OUTCOME_NAMES = ["steps", "stop_reason"]
+
+
+def run_fingerprint(num_companies: int, num_employees: int, settings: Settings) -> str:
+    # Stable across processes and sessions, unlike hash(). The API key is left
+    # out so it never ends up in stored results.
+    parameters = {
+        "num_companies": num_companies,
+        "num_employees": num_employees,
+        **settings.model_dump(exclude={"open_ai_key"}),
+    }
+    return hashlib.blake2b(
+        json.dumps(parameters, sort_keys=True).encode(), digest_size=16
+    ).hexdigest()
+
+
+class RunGroup:
+    # Running totals of the run summaries that share a fingerprint, so groups
+    # can be aggregated while the batch is still running. Diverged runs only
+    # count towards the steps and stop reasons.
+    num_companies: int
+    num_employees: int
+    settings: Settings
+    totals: dict[str, float]
+    stopped_early: int
+    diverged: int
+    steps: int
+
+    def __init__(self, num_companies: int, num_employees: int, settings: Settings):
+        self.num_companies = num_companies
+        self.num_employees = num_employees
+        self.settings = settings
+        self.count = 0
+        self.totals = {}
+        self.stopped_early = 0
+        self.diverged = 0
+        self.steps = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, summary: dict):
+        self.count += 1
+        self.steps += summary["steps"]
+        stop_reason = summary.get("stop_reason", MAX_STEPS)
+        if stop_reason != MAX_STEPS:
+            self.stopped_early += 1
+        if stop_reason in DIVERGED:
+            self.diverged += 1
+            return
+        for name, value in summary.items():
+            if name not in RUN_PARAMETER_NAMES and isinstance(value, (int, float)):
+                self.totals[name] = self.totals.get(name, 0) + value
+
+    def average(self, name: str) -> float:
+        # nan once every run diverged
+        kept = self.count - self.diverged
+        return self.totals[name] / kept if kept else float("nan")
+
+    def average_steps(self) -> float:
+        return self.steps / self.count
+
+
+def add_to_groups(groups: dict[str, RunGroup], summary: dict) -> None:
+    fingerprint = summary["fingerprint"]
+    if fingerprint not in groups:
+        groups[fingerprint] = RunGroup(
+            summary["num_companies"], summary["num_employees"], summary["settings"]
+        )
+    groups[fingerprint].add(summary)
+
+# Set once per worker process by _init_worker instead of being sent with every task
+_worker_settings: Settings | None = None
+# The parent's warmed-up model, inherited by forked workers, see _run_forked
+_forked_model: LaborModel | None = None
+
+
+def _init_worker(settings: Settings, log_level: int) -> None:
+    global _worker_settings
+    _worker_settings = settings
+    logger.setLevel(log_level)
+
+
+def _warmed_up_model(
+    settings: Settings,
+    seed: np.random.SeedSequence,
+    num_employees: int,
+    num_companies: int,
+    warmup_steps: int,
+    headless: bool = True,
+) -> LaborModel:
+    model = LaborModel(num_employees, num_companies, settings, headless=headless, seed=seed)
+    for _ in range(warmup_steps):
+        model.step()
+    return model
+
+
+def warm_up(
+    checkpoint: Path,
+    seed: np.random.SeedSequence,
+    num_employees: int,
+    num_companies: int,
+    warmup_steps: int,
+    headless: bool = True,
+) -> Path:
+    model = _warmed_up_model(
+        _worker_settings, seed, num_employees, num_companies, warmup_steps, headless
+    )
+    save_checkpoint(model, checkpoint)
+    return checkpoint
+
+
+def _fork_variant(model: LaborModel, run: BatchRun) -> LaborModel:
+    model.apply_settings(_worker_settings.model_copy(update=run.setting_overrides))
+    # Variants of an iteration share the warm-up but not what follows
+    model.reseed(run.seed)
+    return model
+
+
+def run_model(
+    run: BatchRun, max_steps: int, headless: bool = True, early_stop: EarlyStop | None = None
+) -> dict:
+    if run.checkpoint:
+        model = _fork_variant(load_checkpoint(run.checkpoint), run)
+    else:
+        settings = _worker_settings.model_copy(update=run.setting_overrides)
+        model = LaborModel(
+            run.num_employees, run.num_companies, settings, headless=headless, seed=run.seed
+        )
+    return _finish_run(model, run, max_steps, early_stop)
+
+
+def run_forked_model(run: BatchRun, max_steps: int, early_stop: EarlyStop | None = None) -> dict:
+    # Every worker runs a single task, so this is the untouched warm model
+    return _finish_run(_fork_variant(_forked_model, run), run, max_steps, early_stop)
+
+
+def _finish_run(
+    model: LaborModel, run: BatchRun, max_steps: int, early_stop: EarlyStop | None
+) -> dict:
+    # Only the steps after a warm-up can be stopped early
+    model.early_stop = early_stop
+    for _ in range(max_steps - model.schedule.steps):
+        model.step()
+        if not model.running:
+            break
+    else:
+        # Same row mesa's batch_run reported: the collectors after the last
+        # step. A stopped run ends on the row early_stop saw.
+        model.datacollector.collect(model)
+    model.close()
+
+    summary = {
+        name: values[-1] for name, values in model.datacollector.model_vars.items()
+    }
+    summary.update(_run_parameters(run))
+    # Collected rows minus one, like max_steps for a run that was not stopped
+    summary["steps"] = model.schedule.steps
+    summary["stop_reason"] = model.stop_reason or MAX_STEPS
+    if run.keep_history:
+        summary["history"] = model.datacollector.model_vars
+    return summary
+
+
+def _run_parameters(run: BatchRun) -> dict:
+    return {
+        "RunId": run.run_id,
+        "iteration": run.iteration,
+        "num_employees": run.num_employees,
+        "num_companies": run.num_companies,
+        "setting_overrides": run.setting_overrides,
+        "fingerprint": run.fingerprint,
+        "seed_entropy": run.seed.entropy,
+        "warmup_steps": run.warmup_steps,
+    }
 
-def sort_closest_groups(groups: list[list[dict]]):
-    EXPECTED_UNEMPLOYMENT = 0.067
-    AVERAGE_TENURE = 29
-    TIME_BETWEEN_JOBS = 2
-    # CHANGE_REASON_QUIT = 0.65
 
-    def calculate_error(group: dict) -> float:
-        unemployment_error = abs(group['average_unemployment_rate'] - EXPECTED_UNEMPLOYMENT) / EXPECTED_UNEMPLOYMENT
-        tenure_error = abs(group['average_work_tenure'] - AVERAGE_TENURE) / AVERAGE_TENURE
-        time_between_jobs_error = abs(group['average_time_between_jobs'] - TIME_BETWEEN_JOBS) / TIME_BETWEEN_JOBS
-        # quit_error = abs(group['average_quit_rate'] - CHANGE_REASON_QUIT) / CHANGE_REASON_QUIT
+def _setting_overrides(base_settings: Settings, settings: Settings) -> dict:
+    base_values = base_settings.model_dump()
+    return {
+        name: value
+        for name, value in settings.model_dump().items()
+        if value != base_values[name]
+    }
+
 
-        return unemployment_error + tenure_error + time_between_jobs_error
+def _load_finished_runs(store: ResultsStore, runs: list[BatchRun]) -> dict[int, dict]:
+    finished_runs = {}
+    for run in runs:
+        parameters = _run_parameters(run)
+        stored_run = store.runs.get(run.run_id)
+        if stored_run and all(stored_run.get(name) == value for name, value in parameters.items()):
+            finished_runs[run.run_id] = {
+                **store.final_row(run.run_id),
+                **parameters,
+                **{name: stored_run[name] for name in RUN_OUTCOME_NAMES},
+            }
+    return finished_runs
+
+
+def run_batch(
+    settings: Settings,
+    setting_variations: list[Settings],
+    num_employees: int,
+    num_companies: int,
+    iterations: int,
+    max_steps: int,
+    number_processes: int | None = None,
+    chunk_size: int = 1,
+    store: ResultsStore | None = None,
+    display_progress: bool = True,
+    headless: bool = True,
+    seed: int | None = None,
+    warmup_steps: int = 0,
+    copy_on_write: bool = False,
+    early_stop: EarlyStop | None = None,
+) -> Iterator[dict]:
+    # A resumed batch keeps the seed it was started with
+    if seed is None and store and store.runs:
+        seed = next(iter(store.runs.values())).get("seed_entropy")
+    variations = {
+        run_fingerprint(num_companies, num_employees, variation): (
+            variation,
+            _setting_overrides(settings, variation),
+        )
+        for variation in setting_variations
+    }
+    if warmup_steps >= max_steps > 0:
+        raise ValueError("warmup_steps has to be smaller than max_steps")
+    if copy_on_write and not warmup_steps:
+        raise ValueError("copy_on_write forks from a warm-up, set warmup_steps")
+    if copy_on_write and "fork" not in get_all_start_methods():
+        raise ValueError("copy_on_write needs the fork start method, which this platform lacks")
+    if warmup_steps:
+        for _, setting_overrides in variations.values():
+            if construction_overrides := CONSTRUCTION_SETTINGS & setting_overrides.keys():
+                raise ValueError(
+                    f"Variants forked after a warm-up cannot change {sorted(construction_overrides)}"
+                )
+    root_seed = np.random.SeedSequence(seed)
+    seeds = root_seed.spawn(iterations * len(variations))
+    # Spawned after the runs' seeds, so those do not depend on warmup_steps
+    warmup_seeds = root_seed.spawn(iterations)
+    runs = []
+    for iteration in range(iterations):
+        for fingerprint, (_, setting_overrides) in variations.items():
+            runs.append(
+                BatchRun(
+                    len(runs),
+                    iteration,
+                    num_employees,
+                    num_companies,
+                    setting_overrides,
+                    fingerprint,
+                    seeds[len(runs)],
+                    warmup_steps,
+                    keep_history=store is not None,
+                )
+            )
+
+    # Runs already in the store from a previous, interrupted batch are not rerun
+    finished_runs = _load_finished_runs(store, runs) if store else {}
+    pending_runs = [run for run in runs if run.run_id not in finished_runs]
+    logger.info("Batch of %s runs, %s already finished", len(runs), len(finished_runs))
+
+    def with_settings(summary: dict) -> dict:
+        summary["settings"] = variations[summary["fingerprint"]][0]
+        return summary
+
+    for summary in finished_runs.values():
+        yield with_settings(summary)
+    if not pending_runs:
+        return
+
+    if store:
+        store.save_settings(settings)
+
+    if copy_on_write:
+        summaries = _run_forked(
+            settings, pending_runs, warmup_seeds, max_steps, number_processes, headless, early_stop
+        )
+    else:
+        summaries = _run_pooled(
+            settings,
+            pending_runs,
+            warmup_seeds,
+            max_steps,
+            number_processes,
+            chunk_size,
+            headless,
+            early_stop,
+        )
+    with tqdm(
+        total=len(runs), initial=len(finished_runs), disable=not display_progress
+    ) as progress:
+        for summary in summaries:
+            if store:
+                store.append_run(
+                    {name: summary[name] for name in RUN_PARAMETER_NAMES + RUN_OUTCOME_NAMES},
+                    summary.pop("history"),
+                )
+            progress.update()
+            yield with_settings(summary)
+
+
+def _run_pooled(
+    settings: Settings,
+    runs: list[BatchRun],
+    warmup_seeds: list[np.random.SeedSequence],
+    max_steps: int,
+    number_processes: int | None,
+    chunk_size: int,
+    headless: bool,
+    early_stop: EarlyStop | None,
+) -> Iterator[dict]:
+    with Pool(
+        number_processes, initializer=_init_worker, initargs=(settings, logger.level)
+    ) as pool, TemporaryDirectory() as checkpoint_directory:
+        warmup_steps = runs[0].warmup_steps
+        if warmup_steps:
+            # One warm-up per iteration that still has runs to do
+            iterations_to_warm = sorted({run.iteration for run in runs})
+            checkpoints = pool.starmap(
+                partial(
+                    warm_up,
+                    num_employees=runs[0].num_employees,
+                    num_companies=runs[0].num_companies,
+                    warmup_steps=warmup_steps,
+                    headless=headless,
+                ),
+                [
+                    (Path(checkpoint_directory, f"iteration_{iteration}.ckpt"), warmup_seeds[iteration])
+                    for iteration in iterations_to_warm
+                ],
+            )
+            checkpoints = dict(zip(iterations_to_warm, checkpoints))
+            for run in runs:
+                run.checkpoint = checkpoints[run.iteration]
+
+        yield from pool.imap_unordered(
+            partial(run_model, max_steps=max_steps, headless=headless, early_stop=early_stop),
+            runs,
+            chunksize=chunk_size,
+        )
+
+
+def _run_forked(
+    settings: Settings,
+    runs: list[BatchRun],
+    warmup_seeds: list[np.random.SeedSequence],
+    max_steps: int,
+    number_processes: int | None,
+    headless: bool,
+    early_stop: EarlyStop | None,
+) -> Iterator[dict]:
+    # The parent simulates each iteration's warm-up itself. Every run gets a
+    # freshly forked worker that inherits the warm model through copy-on-write
+    # memory, instead of a pickled copy.
+    global _forked_model
+    runs_by_iteration = {}
+    for run in runs:
+        runs_by_iteration.setdefault(run.iteration, []).append(run)
+
+    context = get_context("fork")
+    for iteration, iteration_runs in runs_by_iteration.items():
+        _forked_model = _warmed_up_model(
+            settings,
+            warmup_seeds[iteration],
+            iteration_runs[0].num_employees,
+            iteration_runs[0].num_companies,
+            iteration_runs[0].warmup_steps,
+            headless,
+        )
+        # Keeps the workers' garbage collector from writing to, and so
+        # copying, the pages of the inherited objects
+        gc.freeze()
+        try:
+            with context.Pool(
+                number_processes,
+                initializer=_init_worker,
+                initargs=(settings, logger.level),
+                maxtasksperchild=1,
+            ) as pool:
+                yield from pool.imap_unordered(
+                    partial(run_forked_model, max_steps=max_steps, early_stop=early_stop),
+                    iteration_runs,
+                )
+        finally:
+            gc.unfreeze()
+            _forked_model = None
+
+EXPECTED_UNEMPLOYMENT = 0.067
+AVERAGE_TENURE = 29
+TIME_BETWEEN_JOBS = 2
+# CHANGE_REASON_QUIT = 0.65
+# Added to the error per share of diverged runs: a tenth of the runs
+# diverging weighs as much as one statistic being 100% off
+DIVERGED_PENALTY = 10
+
+def calculate_error(group: dict) -> float:
+    # The averages leave diverged runs out, settings whose runs diverge are
+    # penalized here instead
+    diverged_share = group.get('diverged', 0) / group.get('runs', 1)
+    if diverged_share == 1:
+        return math.inf
+    unemployment_error = abs(group['average_unemployment_rate'] - EXPECTED_UNEMPLOYMENT) / EXPECTED_UNEMPLOYMENT
+    tenure_error = abs(group['average_work_tenure'] - AVERAGE_TENURE) / AVERAGE_TENURE
+    time_between_jobs_error = abs(group['average_time_between_jobs'] - TIME_BETWEEN_JOBS) / TIME_BETWEEN_JOBS
+    # quit_error = abs(group['average_quit_rate'] - CHANGE_REASON_QUIT) / CHANGE_REASON_QUIT
+
+    return unemployment_error + tenure_error + time_between_jobs_error + DIVERGED_PENALTY * diverged_share
 
+def sort_closest_groups(groups: list[list[dict]]):
     sorted_groups = sorted(groups, key=calculate_error)
 
     return sorted_groups
 
-def calculate_group_statistics(groups: list[list[dict]]):
+def _group_average(group: list[dict] | RunGroup | StoredRunGroup, name: str) -> float:
+    if isinstance(group, list):
+        values = [item[name] for item in group if item.get('stop_reason', MAX_STEPS) not in DIVERGED]
+        return sum(values) / len(values) if values else float('nan')
+    return group.average(name)
+
+def _group_outcomes(group: list[dict] | RunGroup | StoredRunGroup) -> tuple[float, int, int]:
+    # Converged runs are averaged on their last step like the ones that ran
+    # to max_steps, diverged runs are left out of the averages. How many runs
+    # stopped or diverged and how far runs got is reported next to them.
+    if isinstance(group, list):
+        # Summaries of mesa's batch_run have Step instead of steps
+        steps = [item.get('steps', item.get('Step')) for item in group]
+        stop_reasons = [item.get('stop_reason', MAX_STEPS) for item in group]
+        stopped_early = sum(reason != MAX_STEPS for reason in stop_reasons)
+        diverged = sum(reason in DIVERGED for reason in stop_reasons)
+        return sum(steps) / len(steps), stopped_early, diverged
+    return group.average_steps(), group.stopped_early, group.diverged
+
+def _group_parameters(group: list[dict] | RunGroup | StoredRunGroup) -> tuple[int, int, Settings]:
+    if isinstance(group, list):
+        return group[0]['num_companies'], group[0]['num_employees'], group[0]['settings']
+    return group.num_companies, group.num_employees, group.settings
+
+def calculate_group_statistics(groups: list[list[dict]] | list[RunGroup] | list[StoredRunGroup]):
     statistics = []
 
     for group in groups:
-        total_unemployment_rate = sum(item['Unemployment Rate'] for item in group)
-        average_unemployment_rate = round(total_unemployment_rate / len(group), 3)
+        average_unemployment_rate = round(_group_average(group, 'Unemployment Rate'), 3)
+
+        average_profits = round(_group_average(group, 'Company Profit Average'), 2)
 
-        total_profits = sum(item['Company Profit Average'] for item in group)
-        average_profits = round(total_profits / len(group), 2)
+        average_tenure = round(_group_average(group, 'Average Work Tenure'), 2)
 
-        total_tenure = sum(item['Average Work Tenure'] for item in group)
-        average_tenure = round(total_tenure / len(group), 2)
+        average_time_between_jobs = round(_group_average(group, 'Average Time Between Jobs'), 2)
 
-        total_time_between_jobs = sum(item['Average Time Between Jobs'] for item in group)
-        average_time_between_jobs = round(total_time_between_jobs / len(group), 2)
+        average_quit_rate = round(_group_average(group, 'Average Quit Rate'), 2)
 
-        total_average_quit_rate = sum(item['Average Quit Rate'] for item in group)
-        average_quit_rate = round(total_average_quit_rate / len(group), 2)
+        average_original_companies_left = round(_group_average(group, 'Original Companies Left'), 2)
 
-        total_original_companies_left = sum(item['Original Companies Left'] for item in group)
-        average_original_companies_left = round(total_original_companies_left / len(group), 2)
+        average_original_companies_profits = round(_group_average(group, 'Original Company Profits'), 2)
 
-        total_original_companies_profits = sum(item['Original Company Profits'] for item in group)
-        average_original_companies_profits = round(total_original_companies_profits / len(group), 2)
+        average_steps, stopped_early, diverged = _group_outcomes(group)
 
-        group_settings = group[0]['settings']
+        num_companies, num_employees, group_settings = _group_parameters(group)
         group_info = {
-            'num_companies': group[0]['num_companies'],
-            'num_employees': group[0]['num_employees'],
+            'num_companies': num_companies,
+            'num_employees': num_employees,
             'initial_product_cost': group_settings.initial_product_cost,
             'base_operating_cost': group_settings.base_operating_cost,
             'cost_per_hire': group_settings.cost_per_hire,
@@ -68,23 +532,30 @@ def calculate_group_statistics(groups: list[list[dict]]):
             "average_company_profits": average_profits,
             "average_companies_left": average_original_companies_left,
             "average_original_companies_profits": average_original_companies_profits,
+            "average_steps": round(average_steps, 2),
+            "runs": len(group),
+            "stopped_early": stopped_early,
+            "diverged": diverged,
         }
 
         statistics.append(group_info)
 
     return statistics
 
-def group_elements(data: list[dict]):
-    def grouping_key(d):
-        return tuple((k, d[k] if type(d[k]) is not Settings else list(d[k].model_dump().values())) for k in sorted(d) if k in ['num_companies', 'num_employees', 'settings'])
+def group_elements(data: list[dict] | ResultsStore):
+    if isinstance(data, ResultsStore):
+        return data.group_runs()
 
-    sorted_data = sorted(data, key=grouping_key)
+    def grouping_key(d):
+        if 'fingerprint' in d:
+            return d['fingerprint']
+        return run_fingerprint(d['num_companies'], d['num_employees'], d['settings'])
 
-    grouped_data = []
-    for key, group in groupby(sorted_data, key=grouping_key):
-        grouped_data.append(list(group))
+    grouped_data = {}
+    for d in data:
+        grouped_data.setdefault(grouping_key(d), []).append(d)
 
-    return grouped_data
+    return list(grouped_data.values())
 
 
 def form_all_setting_variations(settings: Settings) -> list[Settings]:
@@ -131,25 +602,18 @@ def main() -> None:
 
     # setting_variations = form_all_setting_variations(settings)
 
-    parameters = {
-        "num_employees": 95,
-        "num_companies": 9,
-        "settings": [settings],
-        "llm_based": False,
-        "open_ai_client": None
-    }
-
-    results = batch_run(
-        model_cls=LaborModel,
-        parameters=parameters,
-        number_processes=None,
+    grouped_results = {}
+    for summary in run_batch(
+        settings,
+        [settings],
+        num_employees=95,
+        num_companies=9,
         iterations=30,
         max_steps=120,
-        display_progress=True
-    )
+    ):
+        add_to_groups(grouped_results, summary)
 
-    grouped_results = group_elements(results)
-    group_stats = calculate_group_statistics(grouped_results)
+    group_stats = calculate_group_statistics(list(grouped_results.values()))
     filtered_groups = sort_closest_groups(group_stats)[:5]
     pprint(filtered_groups)
 
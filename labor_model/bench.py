@@ -0,0 +1,326 @@
+import argparse
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+import json
+import logging
+from multiprocessing import get_context
+from pathlib import Path
+import platform
+import resource
+import subprocess
+from time import perf_counter
+
+from labor_model.config import Settings
+from labor_model.llm_backends import (AsyncStubLLMClient, StubLLMClient,
+                                      StubResponder)
+from labor_model.local_logging import logger
+from labor_model.model import LaborModel
+
+PHASES = [
+    "market_adjustment",
+    "employee_phase",
+    "company_phase",
+    "bankruptcy_check",
+    "data_collection",
+]
+
+# Profiler agent types and scheduled phases that make up the employee and
+# company phases
+PHASE_PROFILE_NAMES = {
+    "employee_phase": ["EmployeeAgent", "EmployeePopulation", "decide_quits"],
+    "company_phase": ["CompanyAgent", "CompanyPopulationAgent", "CompanyLLMAgent", "llm_companies"],
+}
+
+# "llm" runs LLM based companies against the offline stub backend
+ENGINES = ["agents", "vectorized", "llm"]
+
+# (num_employees, num_companies, engine). The agent engine stops at sizes
+# that still finish in minutes.
+DEFAULT_CASES = [
+    (1_000, 10, "agents"),
+    (10_000, 100, "agents"),
+    (1_000, 10, "vectorized"),
+    (10_000, 100, "vectorized"),
+    (100_000, 100, "vectorized"),
+    (1_000_000, 1_000, "vectorized"),
+    (95, 9, "llm"),
+    (1_000, 100, "llm"),
+]
+
+
+@dataclass
+class LLMBenchOptions:
+    # Stub latency is the mean seconds per request
+    latency: float = 0.5
+    error_rate: float = 0.0
+    malformed_rate: float = 0.1
+    asynchronous: bool = True
+    batched: bool = False
+    concurrency: int = 8
+    requests_per_second: float = 5.0
+
+
+@dataclass
+class BenchCase:
+    num_employees: int
+    num_companies: int
+    engine: str
+    steps: int
+    seed: int
+    trace_path: Path | None = None
+    llm: LLMBenchOptions | None = None
+    # Timing per phase costs time itself, so it is off unless asked for
+    profile: bool = False
+    # False places the agents on the model's grid as the visualisation does
+    headless: bool = True
+
+
+@dataclass
+class BenchResult:
+    num_employees: int
+    num_companies: int
+    engine: str
+    steps: int
+    seed: int
+    headless: bool
+    construction_seconds: float
+    step_seconds: float
+    # Wall time per phase summed over all steps, "other" is the schedule
+    # overhead and whatever is not attributed to a phase. Empty unless the
+    # case was profiled.
+    phase_seconds: dict[str, float]
+    # Process peak before the model is built, i.e. what the imports cost
+    baseline_memory_mb: float
+    peak_memory_mb: float
+    llm_requests: int = 0
+    llm_max_in_flight: int = 0
+
+
+def _peak_memory_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(case: BenchCase) -> BenchResult:
+    # The stub's malformed answers are logged as errors by design
+    logger.setLevel(logging.CRITICAL if case.engine == "llm" else logging.ERROR)
+    baseline_memory_mb = _peak_memory_mb()
+
+    responder, llm_arguments = None, {}
+    if case.engine == "llm":
+        llm = case.llm or LLMBenchOptions()
+        responder = StubResponder(llm.latency, llm.error_rate, llm.malformed_rate, case.seed)
+        client_class = AsyncStubLLMClient if llm.asynchronous else StubLLMClient
+        llm_arguments = dict(
+            llm_based=True,
+            open_ai_client=client_class(responder),
+            llm_concurrency=llm.concurrency,
+            llm_requests_per_second=llm.requests_per_second,
+            llm_batched=llm.batched,
+        )
+
+    start = perf_counter()
+    model = LaborModel(
+        case.num_employees,
+        case.num_companies,
+        Settings(open_ai_key=""),
+        vectorized=case.engine == "vectorized",
+        headless=case.headless,
+        profile=case.profile,
+        seed=case.seed,
+        **llm_arguments,
+    )
+    construction_seconds = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(case.steps):
+        model.step()
+    step_seconds = perf_counter() - start
+    model.close()
+
+    timings = {}
+    if model.profiler:
+        seconds = model.profiler.seconds
+        for phase in PHASES:
+            if phase in PHASE_PROFILE_NAMES:
+                timings[phase] = sum(seconds.get(name, 0.0) for name in PHASE_PROFILE_NAMES[phase])
+            else:
+                timings[phase] = seconds.get(phase, 0.0)
+        timings["other"] = max(step_seconds - sum(timings.values()), 0.0)
+        if case.trace_path:
+            model.profiler.save_chrome_trace(case.trace_path)
+    return BenchResult(
+        case.num_employees,
+        case.num_companies,
+        case.engine,
+        case.steps,
+        case.seed,
+        case.headless,
+        construction_seconds,
+        step_seconds,
+        timings,
+        baseline_memory_mb,
+        _peak_memory_mb(),
+        responder.calls if responder else 0,
+        responder.max_in_flight if responder else 0,
+    )
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_bench(cases: list[BenchCase]) -> list[BenchResult]:
+    # Every case runs in a fresh process so peak memory is per case
+    results = []
+    context = get_context("spawn")
+    for case in cases:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_case, (case,))
+        print(
+            f"{result.num_employees:>9} employees {result.num_companies:>5} companies "
+            f"{result.engine:>10} {'headless' if result.headless else 'grid':>8}: "
+            f"construction {result.construction_seconds:.2f}s, "
+            f"{1000 * result.step_seconds / result.steps:.1f}ms/step, "
+            f"peak {result.peak_memory_mb:.0f}MB ({result.baseline_memory_mb:.0f}MB before construction)"
+            + (
+                f", {result.llm_requests / result.steps:.1f} LLM requests/step, "
+                f"{result.llm_max_in_flight} at most in flight"
+                if result.engine == "llm"
+                else ""
+            )
+        )
+        if not result.headless:
+            for headless_result in results:
+                if headless_result.headless and _same_case(headless_result, result):
+                    speedup = result.step_seconds / headless_result.step_seconds
+                    print(f"  headless steps are {speedup:.2f}x faster than with the grid")
+        results.append(result)
+    return results
+
+
+def _same_case(a: BenchResult, b: BenchResult) -> bool:
+    return (a.num_employees, a.num_companies, a.engine, a.steps, a.seed) == (
+        b.num_employees,
+        b.num_companies,
+        b.engine,
+        b.steps,
+        b.seed,
+    )
+
+
+def _parse_case(value: str) -> tuple[int, int]:
+    # "10000x100" -> (10000, 100)
+    num_employees, num_companies = value.lower().split("x")
+    return int(num_employees), int(num_companies)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time LaborModel across population sizes")
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=_parse_case,
+        help="EMPLOYEESxCOMPANIES, e.g. 10000x100. Defaults to a fixed grid of sizes",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=[*ENGINES, "both", "all"],
+        default="both",
+        help="both is agents and vectorized, all adds llm",
+    )
+    parser.add_argument(
+        "--grid",
+        choices=["headless", "grid", "both"],
+        default="headless",
+        help="grid places the agents on the model's grid as the visualisation does, "
+        "both runs every case both ways and reports the headless speedup. "
+        "The vectorized engine only runs headless",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="Also time every phase, which slows the steps down"
+    )
+    parser.add_argument("--steps", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    parser.add_argument(
+        "--trace-dir",
+        type=Path,
+        help="Also write a Chrome trace of every case to this directory, implies --profile",
+    )
+    llm_group = parser.add_argument_group("llm engine", "Stub LLM backend and LLMDecisionEngine options")
+    llm_group.add_argument("--llm-latency", type=float, default=LLMBenchOptions.latency)
+    llm_group.add_argument("--llm-error-rate", type=float, default=LLMBenchOptions.error_rate)
+    llm_group.add_argument("--llm-malformed-rate", type=float, default=LLMBenchOptions.malformed_rate)
+    llm_group.add_argument("--llm-sync", action="store_true", help="Ask one company after another")
+    llm_group.add_argument("--llm-batched", action="store_true")
+    llm_group.add_argument("--llm-concurrency", type=int, default=LLMBenchOptions.concurrency)
+    llm_group.add_argument(
+        "--llm-requests-per-second", type=float, default=LLMBenchOptions.requests_per_second
+    )
+    args = parser.parse_args()
+
+    engines = {"both": ["agents", "vectorized"], "all": ENGINES}.get(args.engine, [args.engine])
+    if args.sizes:
+        sizes = [(e, c, engine) for e, c in args.sizes for engine in engines]
+    else:
+        sizes = [size for size in DEFAULT_CASES if size[2] in engines]
+    llm = LLMBenchOptions(
+        args.llm_latency,
+        args.llm_error_rate,
+        args.llm_malformed_rate,
+        not args.llm_sync,
+        args.llm_batched,
+        args.llm_concurrency,
+        args.llm_requests_per_second,
+    )
+    if args.trace_dir:
+        args.trace_dir.mkdir(parents=True, exist_ok=True)
+    displays = {"headless": [True], "grid": [False], "both": [True, False]}[args.grid]
+    cases = [
+        BenchCase(
+            e,
+            c,
+            engine,
+            args.steps,
+            args.seed,
+            args.trace_dir / f"{e}x{c}_{engine}{'' if headless else '_grid'}.json"
+            if args.trace_dir
+            else None,
+            llm,
+            args.profile or args.trace_dir is not None,
+            headless,
+        )
+        for e, c, engine in sizes
+        for headless in displays
+        # The vectorized engine's employees are never placed on the grid
+        if headless or engine != "vectorized"
+    ]
+
+    results = run_bench(cases)
+    args.output.write_text(
+        json.dumps(
+            {
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "results": [asdict(result) for result in results],
+            },
+            indent=2,
+        )
+    )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+from dataclasses import dataclass
+import logging
+from math import ceil
+from pprint import pprint
+
+import numpy as np
+
+from labor_model.batch import (RunGroup, add_to_groups,
+                               calculate_group_statistics, calculate_error,
+                               form_all_setting_variations, run_batch,
+                               run_fingerprint)
+from labor_model.config import Settings
+from labor_model.early_stop import EarlyStop
+from labor_model.local_logging import logger
+
+
+@dataclass
+class CalibrationResult:
+    settings: Settings
+    # calculate_group_statistics of the candidate's runs
+    statistics: dict
+    iterations: int
+    error: float
+
+
+def _result(group: RunGroup) -> CalibrationResult:
+    statistics = calculate_group_statistics([group])[0]
+    return CalibrationResult(group.settings, statistics, len(group), calculate_error(statistics))
+
+
+def successive_halving(
+    settings: Settings,
+    candidates: list[Settings],
+    num_employees: int,
+    num_companies: int,
+    max_steps: int,
+    min_iterations: int = 1,
+    max_iterations: int = 30,
+    eta: int = 3,
+    seed: int | None = None,
+    **batch_options,
+) -> list[CalibrationResult]:
+    # Every candidate starts with min_iterations runs. After each round only
+    # the best 1/eta by calculate_error stay, and they are run until they have
+    # eta times as many iterations, up to max_iterations. Runs of earlier
+    # rounds keep counting, so the survivors' averages only get more precise.
+    # batch_options are passed to run_batch, e.g. number_processes,
+    # warmup_steps or early_stop.
+    root_seed = np.random.SeedSequence(seed)
+    groups: dict[str, RunGroup] = {}
+    survivors = {
+        run_fingerprint(num_companies, num_employees, candidate): candidate
+        for candidate in candidates
+    }
+    iterations = min(min_iterations, max_iterations)
+    round_number = 0
+    while True:
+        done = min((len(groups[fingerprint]) for fingerprint in survivors if fingerprint in groups), default=0)
+        round_seed = int(root_seed.spawn(1)[0].generate_state(1, np.uint64)[0])
+        for summary in run_batch(
+            settings,
+            list(survivors.values()),
+            num_employees,
+            num_companies,
+            iterations - done,
+            max_steps,
+            seed=round_seed,
+            **batch_options,
+        ):
+            add_to_groups(groups, summary)
+
+        ranked = sorted(survivors, key=lambda fingerprint: _result(groups[fingerprint]).error)
+        best = _result(groups[ranked[0]])
+        logger.info(
+            "Calibration round %s: %s candidates with %s iterations, best error %.3f",
+            round_number,
+            len(survivors),
+            iterations,
+            best.error,
+        )
+        if len(survivors) == 1 or iterations >= max_iterations:
+            break
+        survivors = {fingerprint: survivors[fingerprint] for fingerprint in ranked[: ceil(len(ranked) / eta)]}
+        iterations = min(iterations * eta, max_iterations)
+        round_number += 1
+
+    # Candidates that got furthest first, each stage ordered by error
+    results = [_result(group) for group in groups.values()]
+    return sorted(results, key=lambda result: (-result.iterations, result.error))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Search form_all_setting_variations for the settings closest to the expected statistics"
+    )
+    parser.add_argument("--employees", type=int, default=95)
+    parser.add_argument("--companies", type=int, default=9)
+    parser.add_argument("--steps", type=int, default=120)
+    parser.add_argument("--min-iterations", type=int, default=1)
+    parser.add_argument("--max-iterations", type=int, default=30)
+    parser.add_argument("--eta", type=int, default=3)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument(
+        "--early-stop", action="store_true", help="End diverged or converged runs before --steps"
+    )
+    args = parser.parse_args()
+
+    logger.setLevel(logging.ERROR)
+    settings = Settings()
+    results = successive_halving(
+        settings,
+        form_all_setting_variations(settings),
+        args.employees,
+        args.companies,
+        args.steps,
+        args.min_iterations,
+        args.max_iterations,
+        args.eta,
+        args.seed,
+        number_processes=args.processes,
+        early_stop=EarlyStop() if args.early_stop else None,
+    )
+    for result in results[: args.top]:
+        pprint(
+            {
+                "error": round(result.error, 3),
+                "iterations": result.iterations,
+                "quitting_multiplier": result.settings.quitting_multiplier,
+                "company_fire_probability": result.settings.company_fire_probability,
+                "company_emergency_months": result.settings.company_emergency_months,
+                **result.statistics,
+            }
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+from pathlib import Path
+import pickle
+import struct
+import zlib
+
+from openai import AsyncOpenAI, OpenAI
+
+from labor_model.llm_cache import PromptCache
+from labor_model.model import LaborModel
+
+# File layout: magic, format version, then the zlib compressed pickle of the
+# model. The version changes whenever a model class changes incompatibly.
+CHECKPOINT_MAGIC = b"LABORCKP"
+CHECKPOINT_VERSION = 1
+HEADER = struct.Struct(">8sH")
+
+
+def checkpoint_bytes(model: LaborModel) -> bytes:
+    # Everything the next step depends on: agents, bankrupt companies, work
+    # history, counters, product_cost, the generators' states and the
+    # collector's history
+    payload = zlib.compress(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+    return HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION) + payload
+
+
+def model_from_checkpoint_bytes(
+    data: bytes,
+    open_ai_client: OpenAI | AsyncOpenAI | None = None,
+    llm_cache: PromptCache | None = None,
+) -> LaborModel:
+    magic, version = HEADER.unpack_from(data)
+    if magic != CHECKPOINT_MAGIC:
+        raise ValueError("Not a LaborModel checkpoint")
+    if version != CHECKPOINT_VERSION:
+        raise ValueError(
+            f"Checkpoint format version {version} is not supported, expected {CHECKPOINT_VERSION}"
+        )
+    model = pickle.loads(zlib.decompress(data[HEADER.size :]))
+
+    # Clients and connections are not saved, an LLM based model gets them back here
+    model.llm_cache = llm_cache
+    for company in model.llm_companies:
+        company.open_ai = open_ai_client
+    if model.llm_engine is not None:
+        model.llm_engine.client = open_ai_client
+        model.llm_engine.cache = llm_cache
+    return model
+
+
+def save_checkpoint(model: LaborModel, path: Path) -> None:
+    # Written next to the target and renamed, so a crash never leaves a
+    # truncated checkpoint behind
+    path = Path(path)
+    temporary_path = path.with_name(path.name + ".tmp")
+    temporary_path.write_bytes(checkpoint_bytes(model))
+    os.replace(temporary_path, path)
+
+
+def load_checkpoint(
+    path: Path,
+    open_ai_client: OpenAI | AsyncOpenAI | None = None,
+    llm_cache: PromptCache | None = None,
+) -> LaborModel:
+    return model_from_checkpoint_bytes(Path(path).read_bytes(), open_ai_client, llm_cache)
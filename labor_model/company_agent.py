@@ -1,5 +1,3 @@
-from random import random
-
 from labor_model.company_agent_base import CompanyAgentBase
 from labor_model.employee_agent import Application
 from labor_model.utils import AVERAGE_PRODUCTIVITY
@@ -7,11 +5,12 @@ from labor_model.utils import AVERAGE_PRODUCTIVITY
 
 class CompanyAgent(CompanyAgentBase):
     def _choose_best_application(self) -> Application:
+        noise = self.model.rng.random(len(self.applications)) * 2
         return min(
-            self.applications,
-            key=lambda application: application.desired_salary
-            / (application.employee.productivity - 1 + random() * 2),
-        )
+            zip(self.applications, noise),
+            key=lambda pair: pair[0].desired_salary
+            / (pair[0].employee.productivity - 1 + pair[1]),
+        )[0]
 
     def _decide_whether_to_fire(
         self,
@@ -25,7 +24,7 @@ class CompanyAgent(CompanyAgentBase):
             monthly_employee_cost > monthly_earnings
             or total_productivity > self.available_sellable_products_count
         ):
-            return random() < self.model.company_fire_probability
+            return self.model.uniforms.next() < self.model.company_fire_probability
         return False
 
     def _contemplate_hiring(self, total_productivity: float) -> bool:
@@ -41,6 +40,4 @@ class CompanyAgent(CompanyAgentBase):
     def _calculate_employee_average_salary(self) -> float:
         if not self.employees:
             return self.model.initial_salary
-        return sum(employee.current_salary for employee in self.employees) / len(
-            self.employees
-        )
+        return self.payroll / len(self.employees)
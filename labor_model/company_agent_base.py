@@ -1,8 +1,10 @@
-from random import random
+from math import isclose
 
 import mesa
 
-from labor_model.employee_agent import Application, EmployeeAgent
+from labor_model.efficiency_heap import EfficiencyHeap
+from labor_model.employee_agent import (Application, ApplicationBuffer,
+                                        EmployeeAgent)
 from labor_model.local_logging import logger
 
 
@@ -12,9 +14,17 @@ class CompanyAgentBase(mesa.Agent):
     market_share: float
     available_sellable_products_count: int
 
-    accepting_applications: bool
-    applications: list[Application]
+    applications: ApplicationBuffer
     employees: list[EmployeeAgent]
+    # Running totals over self.employees, see _add_employee / _remove_employee
+    payroll: float
+    total_productivity: float
+    efficiency: EfficiencyHeap
+
+    # Cells employees move to, nearest ring first, and every cell within two
+    # steps. Set by LaborModel._place_company, empty when the company has no cell.
+    move_targets: list[tuple[int, int]]
+    nearby_cells: frozenset[tuple[int, int]]
 
     def __init__(
         self,
@@ -30,20 +40,41 @@ class CompanyAgentBase(mesa.Agent):
         self.available_sellable_products_count = available_sellable_products_count
 
         self.accepting_applications = True
-        self.applications = []
+        self.applications = ApplicationBuffer()
         self.employees = []
+        self.payroll = 0
+        self.total_productivity = 0
+        self.efficiency = EfficiencyHeap()
+        self.move_targets = []
+        self.nearby_cells = frozenset()
 
         self.starting_funds = funds
         self.funds = funds
 
+    @property
+    def accepting_applications(self) -> bool:
+        return self._accepting_applications
+
+    @accepting_applications.setter
+    def accepting_applications(self, accepting: bool):
+        self._accepting_applications = accepting
+        # Bankrupt companies keep stepping but must not re-enter the pool
+        if not accepting:
+            self.model.hiring_pool.discard(self)
+        elif self.model.companies_by_id.get(self.unique_id) is self:
+            self.model.hiring_pool.add(self)
+
     def step(self):
-        logger.info(f"Company #{self.unique_id} step. Funds: {self.funds:.2f}. ")
+        logger.info("Company #%s step. Funds: %.2f. ", self.unique_id, self.funds)
 
         total_productivity = self._calculate_total_productivity()
         monthly_expenses = self._calculate_monthly_expenses()
         monthly_earnings = self._calculate_earnings()
         logger.info(
-            f"Company #{self.unique_id} monthly earnings: {monthly_earnings:.2f}. Monthly expenses: {monthly_expenses:.2f}."
+            "Company #%s monthly earnings: %.2f. Monthly expenses: %.2f.",
+            self.unique_id,
+            monthly_earnings,
+            monthly_expenses,
         )
 
         self.funds -= monthly_expenses
@@ -62,55 +93,97 @@ class CompanyAgentBase(mesa.Agent):
         else:
             self.accepting_applications = False
 
-        self.applications = []
+        self.applications.clear()
 
-        if self.employees and self._decide_whether_to_fire(
+        if self._employee_count() and self._decide_whether_to_fire(
             monthly_expenses, monthly_earnings, total_productivity
         ):
             self._fire_inefficient_employee()
 
+    def _employee_count(self) -> int:
+        return len(self.employees)
+
     def _calculate_monthly_expenses(self) -> float:
-        return sum(
-            employee.current_salary for employee in self.employees
-        ) + self.model.company_operating_cost
+        return self.payroll + self.model.company_operating_cost
 
     def _calculate_earnings(self) -> float:
         return self._calculate_total_productivity() * self.model.product_cost
 
     def _calculate_total_productivity(self) -> float:
-        return sum(
+        return self.total_productivity
+
+    def _add_employee(self, employee: EmployeeAgent):
+        self.employees.append(employee)
+        self.payroll += employee.current_salary
+        self.total_productivity += employee.productivity
+        self.efficiency.push(employee)
+
+    def _remove_employee(self, employee: EmployeeAgent):
+        self.employees.remove(employee)
+        self.payroll -= employee.current_salary
+        self.total_productivity -= employee.productivity
+        self.efficiency.remove(employee)
+
+    def _recalculate_totals(self):
+        self.payroll = sum(employee.current_salary for employee in self.employees)
+        self.total_productivity = sum(
             employee.productivity for employee in self.employees
         )
 
+    def _check_totals(self):
+        # Compares without touching the running totals, so checked runs match
+        # unchecked ones
+        payroll = sum(employee.current_salary for employee in self.employees)
+        total_productivity = sum(employee.productivity for employee in self.employees)
+        if not isclose(self.payroll, payroll, rel_tol=1e-9, abs_tol=1e-6) or not isclose(
+            self.total_productivity, total_productivity, rel_tol=1e-9, abs_tol=1e-6
+        ):
+            raise AssertionError(
+                f"Company #{self.unique_id} totals drifted. Payroll: {self.payroll} != {payroll}. "
+                f"Productivity: {self.total_productivity} != {total_productivity}."
+            )
+
+    def _apply_salary_raise(self, rate: float):
+        for employee in self.employees:
+            employee.current_salary *= 1 + rate
+        self._recalculate_totals()
+        self.efficiency.rebuild()
+
     def _fire_inefficient_employee(self):
-        least_efficient_employee = max(
-            self.employees,
-            key=lambda employee: employee.current_salary / employee.productivity,
-        )
-        self._fire_employee(least_efficient_employee)
+        self._fire_employee(self.efficiency.least_efficient())
 
     def _fire_employee(self, employee: EmployeeAgent):
         self.model.fire_count += 1
-        self.employees.remove(employee)
+        self._remove_employee(employee)
         logger.info(
-            f"Company #{self.unique_id} fired employee #{employee.unique_id}"
+            "Company #%s fired employee #%s", self.unique_id, employee.unique_id
         )
         employee.change_work_state()
 
+    def _lay_off_employees(self):
+        for employee in self.employees:
+            employee.change_work_state()
+        self.employees = []
+        self.payroll = 0
+        self.total_productivity = 0
+        self.efficiency.clear()
+
     def _hire_applicant(self, application: Application) -> bool:
         applicant = application.employee
         self.applications.remove(application)
         if not applicant.is_working:
             logger.warning(
-                f"Company #{self.unique_id} hired employee #{applicant.unique_id}"
+                "Company #%s hired employee #%s", self.unique_id, applicant.unique_id
             )
-            self.employees.append(applicant)
             applicant.change_work_state(self.unique_id, application.desired_salary)
+            self._add_employee(applicant)
 
             self.funds -= self.model.cost_per_hire
         else:
             logger.info(
-                f"Company #{self.unique_id} unable to hire employee #{applicant.unique_id}, because he is already working"
+                "Company #%s unable to hire employee #%s, because he is already working",
+                self.unique_id,
+                applicant.unique_id,
             )
             return False
         return True
@@ -118,7 +191,7 @@ class CompanyAgentBase(mesa.Agent):
     def _refuse_applicant(self, application: Application):
         applicant = application.employee
         logger.info(
-            f"Company #{self.unique_id} refused employee #{applicant.unique_id}"
+            "Company #%s refused employee #%s", self.unique_id, applicant.unique_id
         )
         self.applications.remove(application)
 
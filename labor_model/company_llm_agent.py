@@ -1,14 +1,17 @@
 import mesa
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 from labor_model.company_agent_base import CompanyAgentBase
 from labor_model.employee_agent import Application, EmployeeAgent
+from labor_model.llm_cache import ReplayMiss
 from labor_model.llm_deciding import Decision, ask_about_employee_count, ask_which_to_fire, ask_which_to_hire
 from labor_model.local_logging import logger
 
 
 class CompanyLLMAgent(CompanyAgentBase):
-    open_ai: OpenAI
+    # An AsyncOpenAI client is only used through LaborModel.llm_engine
+    # None when replaying recorded answers from LaborModel.llm_cache
+    open_ai: OpenAI | AsyncOpenAI | None
     previous_decision: Decision
 
     def __init__(
@@ -18,7 +21,7 @@ class CompanyLLMAgent(CompanyAgentBase):
         market_share: float,
         available_sellable_products_count: int,
         funds: int,
-        open_ai: OpenAI,
+        open_ai: OpenAI | AsyncOpenAI | None,
     ):
         super().__init__(
             unique_id,
@@ -34,69 +37,121 @@ class CompanyLLMAgent(CompanyAgentBase):
         self.parses_failed = 0
         self.parses_succeeded = 0
 
+    def __getstate__(self) -> dict:
+        # See LaborModel.__getstate__
+        state = self.__dict__.copy()
+        state["open_ai"] = None
+        return state
+
     def step(self):
-        logger.info(f"Company #{self.unique_id} step. Funds: {self.funds:.2f}. Decision: {self.previous_decision}.")
+        if self.model.llm_engine is not None:
+            # Stepped together with the other LLM companies, see LaborModel._step_llm_companies
+            return
 
-        total_productivity = self._calculate_total_productivity()
-        monthly_operating_cost = self._calculate_monthly_expenses()
-        monthly_earnings = self._calculate_earnings()
-        logger.info(
-            f"Company #{self.unique_id} monthly earnings: {monthly_earnings:.2f}. Monthly employee cost: {monthly_operating_cost:.2f}."
-        )
-
-        self.funds -= monthly_operating_cost
-        self.funds += monthly_earnings
-        logger.debug(f"Company #{self.unique_id}: Total productivity: {total_productivity:.2f}. Available sellable products: {self.available_sellable_products_count}.")
-        selling_all = total_productivity < self.available_sellable_products_count
+        selling_all, monthly_earnings, monthly_operating_cost = self._settle_month()
 
         if self.previous_decision != Decision.HIRE:
             try:
-                employment_decision = ask_about_employee_count(self.open_ai, self.funds, selling_all, monthly_earnings, monthly_operating_cost)
-                self.parses_succeeded += 1
+                with self.model.profile_span("ask_about_employee_count", "llm"):
+                    answer = ask_about_employee_count(self.open_ai, self.funds, selling_all, monthly_earnings, monthly_operating_cost, self.model.llm_cache)
             except Exception as e:
-                logger.error(f"Company #{self.unique_id}: Error asking about employee count. {str(e)}")
-                self.parses_failed += 1
-                employment_decision = Decision.NOTHING
+                answer = e
+            employment_decision = self._employment_decision_from(answer)
         else:
             employment_decision = Decision.HIRE
-        logger.debug(f"Company #{self.unique_id}: Employment decision: {employment_decision}")
-        self.previous_decision = employment_decision
+        employment_decision = self._record_employment_decision(employment_decision)
 
-        if employment_decision == Decision.HIRE:
-            self.accepting_applications = True
-            if self.applications:
-                try:
-                    best_application = self._choose_best_application()
-                    self.parses_succeeded += 1
-                except Exception as e:
-                    self.parses_failed += 1
-                    logger.error(f"Company #{self.unique_id}: Error choosing best application. {str(e)}")
-                    best_application = None
-
-                if best_application and self._hire_applicant(best_application):
-                    self.applications = []
-                    self.accepting_applications = False
-                    self.previous_decision = Decision.NOTHING
+        if employment_decision == Decision.HIRE and self.applications:
+            try:
+                best_application = self._choose_best_application()
+            except Exception as e:
+                best_application = e
+            self._hire_chosen_application(best_application)
         elif employment_decision == Decision.FIRE:
             try:
                 worst_employee = self._choose_who_to_fire()
-                self.parses_succeeded += 1
             except Exception as e:
-                logger.error(f"Company #{self.unique_id}: Error choosing who to fire. {str(e)}")
-                worst_employee = None
-                self.parses_failed += 1
+                worst_employee = e
+            self._fire_chosen_employee(worst_employee)
 
-            if worst_employee:
-                self._fire_employee(worst_employee)
-            self.accepting_applications = False
+        self.applications.clear()
+
+    def _settle_month(self) -> tuple[bool, float, float]:
+        logger.info("Company #%s step. Funds: %.2f. Decision: %s.", self.unique_id, self.funds, self.previous_decision)
 
-        self.applications = []
+        total_productivity = self._calculate_total_productivity()
+        monthly_operating_cost = self._calculate_monthly_expenses()
+        monthly_earnings = self._calculate_earnings()
+        logger.info(
+            "Company #%s monthly earnings: %.2f. Monthly employee cost: %.2f.",
+            self.unique_id,
+            monthly_earnings,
+            monthly_operating_cost,
+        )
 
+        self.funds -= monthly_operating_cost
+        self.funds += monthly_earnings
+        logger.debug(
+            "Company #%s: Total productivity: %.2f. Available sellable products: %s.",
+            self.unique_id,
+            total_productivity,
+            self.available_sellable_products_count,
+        )
+        selling_all = total_productivity < self.available_sellable_products_count
+        return selling_all, monthly_earnings, monthly_operating_cost
+
+    def _employment_decision_from(self, answer: Decision | Exception) -> Decision:
+        _raise_replay_miss(answer)
+        if isinstance(answer, Exception):
+            logger.error("Company #%s: Error asking about employee count. %s", self.unique_id, answer)
+            self.parses_failed += 1
+            return Decision.NOTHING
+        self.parses_succeeded += 1
+        return answer
+
+    def _record_employment_decision(self, employment_decision: Decision) -> Decision:
+        logger.debug("Company #%s: Employment decision: %s", self.unique_id, employment_decision)
+        self.previous_decision = employment_decision
+        if employment_decision == Decision.HIRE:
+            self.accepting_applications = True
+        return employment_decision
+
+    def _hire_chosen_application(self, best_application: Application | Exception):
+        _raise_replay_miss(best_application)
+        if isinstance(best_application, Exception):
+            self.parses_failed += 1
+            logger.error("Company #%s: Error choosing best application. %s", self.unique_id, best_application)
+            return
+        self.parses_succeeded += 1
+
+        if self._hire_applicant(best_application):
+            self.applications.clear()
+            self.accepting_applications = False
+            self.previous_decision = Decision.NOTHING
+
+    def _fire_chosen_employee(self, worst_employee: EmployeeAgent | Exception):
+        _raise_replay_miss(worst_employee)
+        if isinstance(worst_employee, Exception):
+            logger.error("Company #%s: Error choosing who to fire. %s", self.unique_id, worst_employee)
+            self.parses_failed += 1
+        else:
+            self.parses_succeeded += 1
+            self._fire_employee(worst_employee)
+        self.accepting_applications = False
 
     def _choose_best_application(self) -> Application:
-        logger.debug(f"Company #{self.unique_id}: Choosing best application")
-        return ask_which_to_hire(self.open_ai, self.funds, self.applications)
+        logger.debug("Company #%s: Choosing best application", self.unique_id)
+        with self.model.profile_span("ask_which_to_hire", "llm"):
+            return ask_which_to_hire(self.open_ai, self.funds, self.applications, self.model.llm_cache)
 
     def _choose_who_to_fire(self) -> EmployeeAgent:
-        logger.debug(f"Company #{self.unique_id}: Choosing who to fire")
-        return ask_which_to_fire(self.open_ai, self.employees)
+        logger.debug("Company #%s: Choosing who to fire", self.unique_id)
+        with self.model.profile_span("ask_which_to_fire", "llm"):
+            return ask_which_to_fire(self.open_ai, self.employees, self.model.llm_cache)
+
+
+def _raise_replay_miss(answer):
+    # A replay that diverged from its recording cannot go on as if the
+    # request had failed, its results would not be the recorded ones
+    if isinstance(answer, ReplayMiss):
+        raise answer
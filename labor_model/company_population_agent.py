@@ -0,0 +1,109 @@
+import mesa
+import numpy as np
+
+from labor_model.company_agent import CompanyAgent
+from labor_model.employee_agent import ApplicationBuffer
+from labor_model.employee_population import (ApplicationBatch,
+                                             BatchedApplication,
+                                             PopulationMember)
+from labor_model.local_logging import logger
+
+
+class CompanyPopulationAgent(CompanyAgent):
+    # CompanyAgent whose employees live in the model's EmployeePopulation
+    # arrays. Decision rules are inherited, only the bookkeeping differs.
+    slot: int
+    applications: ApplicationBatch | ApplicationBuffer
+
+    def __init__(
+        self,
+        unique_id: int,
+        model: mesa.Model,
+        market_share: float,
+        available_sellable_products_count: int,
+        funds: int,
+    ):
+        super().__init__(
+            unique_id,
+            model,
+            market_share,
+            available_sellable_products_count,
+            funds,
+        )
+        self.population = model.population
+        self.slot = self.population.register_company(self)
+
+    def _employee_count(self) -> int:
+        return int(self.population.headcount[self.slot])
+
+    def _calculate_monthly_expenses(self) -> float:
+        return float(self.population.payroll[self.slot]) + self.model.company_operating_cost
+
+    def _calculate_total_productivity(self) -> float:
+        return float(self.population.total_productivity[self.slot])
+
+    def _calculate_employee_average_salary(self) -> float:
+        headcount = self._employee_count()
+        if not headcount:
+            return self.model.initial_salary
+        return float(self.population.payroll[self.slot]) / headcount
+
+    def _check_totals(self):
+        members = np.flatnonzero(self.population.employer == self.slot)
+        if not np.array_equal(members, self.population.members_of(self)):
+            raise AssertionError(f"Company #{self.unique_id} member index drifted from the employer array")
+        payroll = self.population.salary[members].sum()
+        total_productivity = self.population.productivity[members].sum()
+        if (
+            not np.isclose(payroll, self.population.payroll[self.slot])
+            or not np.isclose(total_productivity, self.population.total_productivity[self.slot])
+            or len(members) != self._employee_count()
+        ):
+            raise AssertionError(f"Company #{self.unique_id} totals drifted from its members")
+
+    def _choose_best_application(self) -> BatchedApplication:
+        positions = np.flatnonzero(self.applications.pending)
+        applicants = self.applications.applicants[positions]
+        keys = self.applications.desired_salaries[positions] / (
+            self.population.productivity[applicants]
+            - 1
+            + self.population.rng.random(len(positions)) * 2
+        )
+        best = int(positions[np.argmin(keys)])
+        return BatchedApplication(
+            PopulationMember(self.population, int(self.applications.applicants[best])),
+            float(self.applications.desired_salaries[best]),
+            best,
+        )
+
+    def _hire_applicant(self, application: BatchedApplication) -> bool:
+        applicant = application.employee
+        self.applications.remove(application)
+        if applicant.is_working:
+            logger.info(
+                "Company #%s unable to hire employee #%s, because he is already working",
+                self.unique_id,
+                applicant.unique_id,
+            )
+            return False
+
+        logger.warning(
+            "Company #%s hired employee #%s", self.unique_id, applicant.unique_id
+        )
+        self.population.hire(applicant.index, self, application.desired_salary)
+        self.funds -= self.model.cost_per_hire
+        return True
+
+    def _fire_inefficient_employee(self):
+        index = self.population.least_efficient_member(self)
+        self._fire_employee(PopulationMember(self.population, index))
+
+    def _fire_employee(self, employee: PopulationMember):
+        self.model.fire_count += 1
+        logger.info(
+            "Company #%s fired employee #%s", self.unique_id, employee.unique_id
+        )
+        self.population.separate(employee.index)
+
+    def _lay_off_employees(self):
+        self.population.separate(self.population.members_of(self))
@@ -5,6 +5,9 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     open_ai_key: str
+    # "openai" or "stub", see llm_backends.create_llm_client
+    llm_backend: str = "openai"
+    open_ai_base_url: str | None = None
 
     initial_product_cost: int = 222
     base_operating_cost: int = 79
@@ -0,0 +1,94 @@
+from dataclasses import dataclass, field
+from statistics import fmean, pstdev
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from labor_model.model import LaborModel
+
+ALL_ORIGINAL_COMPANIES_BANKRUPT = "all_original_companies_bankrupt"
+BANKRUPTCY_CASCADE = "bankruptcy_cascade"
+UNEMPLOYMENT_PINNED = "unemployment_pinned"
+FULL_EMPLOYMENT_LOSSES = "full_employment_losses"
+CONVERGED = "converged"
+# Recorded for runs that were not stopped early
+MAX_STEPS = "max_steps"
+# Runs stopped for these reasons end on a collapsed economy, not a
+# comparable state, and are left out of the group averages
+DIVERGED = frozenset(
+    {ALL_ORIGINAL_COMPANIES_BANKRUPT, BANKRUPTCY_CASCADE, UNEMPLOYMENT_PINNED, FULL_EMPLOYMENT_LOSSES}
+)
+
+
+@dataclass
+class EarlyStop:
+    # Watches the StepStatsCollector values as they are collected and names
+    # the reason a run should end early, if there is one. It keeps no state
+    # of its own, so one instance can serve every run of a batch.
+
+    # No run is stopped before this many collected steps
+    min_steps: int = 24
+    # Unemployment at 1 for this many consecutive steps. Healthy runs often
+    # employ everyone for a year, so unemployment at 0 only counts while the
+    # average company profit is falling over the same steps: payroll that
+    # outgrows what the companies sell.
+    pinned_steps: int = 12
+    # This share of the original companies going bankrupt within the window
+    cascade_share: float = 0.5
+    cascade_window: int = 12
+    # Converged once the mean of every tracked reporter over the last window
+    # moved less than convergence_tolerance, relative to itself, from the
+    # window before, and the reporter's standard deviation within the last
+    # window is at most convergence_max_cv of its mean. A single run never
+    # stops fluctuating, the second bound only rules out swings that happen
+    # to average out. None turns convergence stopping off.
+    convergence_window: int | None = 24
+    convergence_tolerance: float = 0.05
+    convergence_max_cv: float = 0.1
+    # Means below this magnitude are compared in absolute terms
+    convergence_floor: float = 0.01
+    tracked: list[str] = field(
+        default_factory=lambda: [
+            "Unemployment Rate",
+            "Average Work Tenure",
+            "Average Time Between Jobs",
+            "Average Quit Rate",
+        ]
+    )
+
+    def check(self, model: "LaborModel") -> str | None:
+        history = model.datacollector.model_vars
+        steps = len(history["Unemployment Rate"])
+        if steps < self.min_steps:
+            return None
+
+        companies_left = history["Original Companies Left"]
+        if companies_left[-1] == 0:
+            return ALL_ORIGINAL_COMPANIES_BANKRUPT
+        window_start = companies_left[max(steps - 1 - self.cascade_window, 0)]
+        if window_start - companies_left[-1] >= self.cascade_share * model.num_companies:
+            return BANKRUPTCY_CASCADE
+
+        pinned = history["Unemployment Rate"][-self.pinned_steps :]
+        if all(rate >= 1 for rate in pinned):
+            return UNEMPLOYMENT_PINNED
+        profits = history["Company Profit Average"][-self.pinned_steps :]
+        if all(rate <= 0 for rate in pinned) and profits[-1] < profits[0]:
+            return FULL_EMPLOYMENT_LOSSES
+
+        if self.convergence_window and self._converged(history, steps):
+            return CONVERGED
+        return None
+
+    def _converged(self, history: dict[str, list], steps: int) -> bool:
+        window = self.convergence_window
+        if steps < 2 * window:
+            return False
+        for name in self.tracked:
+            previous, last = history[name][-2 * window : -window], history[name][-window:]
+            previous_mean, last_mean = fmean(previous), fmean(last)
+            scale = max(abs(previous_mean), self.convergence_floor)
+            if abs(last_mean - previous_mean) > self.convergence_tolerance * scale:
+                return False
+            if pstdev(last) > self.convergence_max_cv * scale:
+                return False
+        return True
@@ -0,0 +1,53 @@
+import heapq
+from itertools import count
+
+from labor_model.employee_agent import EmployeeAgent
+
+
+class EfficiencyHeap:
+    # Employees ordered by salary / productivity, least efficient on top.
+    # Removed employees are dropped lazily when they reach the top.
+    entries: list[tuple[float, int, EmployeeAgent]]
+    live_entries: dict[EmployeeAgent, tuple[float, int, EmployeeAgent]]
+
+    def __init__(self):
+        self.entries = []
+        self.live_entries = {}
+        self.sequence = count()
+
+    def __len__(self) -> int:
+        return len(self.live_entries)
+
+    def push(self, employee: EmployeeAgent):
+        # The sequence number keeps ties in hiring order, like max() over the roster
+        self._push(employee, next(self.sequence))
+
+    def remove(self, employee: EmployeeAgent):
+        del self.live_entries[employee]
+        if len(self.entries) > 2 * len(self.live_entries) + 16:
+            self.rebuild()
+
+    def clear(self):
+        self.entries = []
+        self.live_entries = {}
+
+    def rebuild(self):
+        # Needed whenever salaries change, e.g. after the yearly raises
+        live_entries = sorted(self.live_entries.values(), key=lambda entry: entry[1])
+        self.entries = []
+        self.live_entries = {}
+        for _, sequence, employee in live_entries:
+            entry = (-employee.current_salary / employee.productivity, sequence, employee)
+            self.entries.append(entry)
+            self.live_entries[employee] = entry
+        heapq.heapify(self.entries)
+
+    def least_efficient(self) -> EmployeeAgent:
+        while self.live_entries.get(self.entries[0][2]) is not self.entries[0]:
+            heapq.heappop(self.entries)
+        return self.entries[0][2]
+
+    def _push(self, employee: EmployeeAgent, sequence: int):
+        entry = (-employee.current_salary / employee.productivity, sequence, employee)
+        self.live_entries[employee] = entry
+        heapq.heappush(self.entries, entry)
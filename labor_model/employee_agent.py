@@ -2,30 +2,77 @@ from dataclasses import dataclass
 from enum import Enum
 
 import mesa
+import numpy as np
 from scipy.stats import dweibull, gamma
 
 from labor_model.local_logging import logger
-from labor_model.utils import (
-                               decide_based_on_probability)
+from labor_model.work_history import WorkRecord
 
 search_probability_f = dweibull(0.4093106, 0.9999999, 0.2369317)
 leave_probability_f = gamma(1.6878294628925388, -0.3202142090949511, 15.104677133022975)
 
+# time_in_state is a whole number of months, so the pdf only has to be evaluated
+# once per month. Past 100 years the density is indistinguishable from zero.
+LEAVE_PROBABILITY_TABLE = leave_probability_f.pdf(np.arange(1200))
 
-@dataclass
-class WorkRecord:
-    employer_id: int
-    salary: int
-    from_time: int
-    to_time: int | None
 
+def leave_probabilities(times_in_state: np.ndarray) -> np.ndarray:
+    return LEAVE_PROBABILITY_TABLE[
+        np.minimum(times_in_state, len(LEAVE_PROBABILITY_TABLE) - 1)
+    ]
 
-@dataclass
+
+@dataclass(slots=True)
 class Application:
     employee: "EmployeeAgent"
     desired_salary: int
 
 
+class ApplicationBuffer:
+    # A company's applications for the current month. Application objects are
+    # kept after clear() and refilled next month instead of being reallocated.
+    # Iterates and indexes like the list it replaces, in application order.
+    __slots__ = ("applications", "count")
+
+    def __init__(self):
+        self.applications = []
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        return iter(self.applications[: self.count])
+
+    def __getitem__(self, index: int) -> Application:
+        if not -self.count <= index < self.count:
+            raise IndexError("application index out of range")
+        return self.applications[index % self.count]
+
+    def append(self, employee: "EmployeeAgent", desired_salary: int):
+        if self.count < len(self.applications):
+            application = self.applications[self.count]
+            application.employee = employee
+            application.desired_salary = desired_salary
+        else:
+            self.applications.append(Application(employee, desired_salary))
+        self.count += 1
+
+    def remove(self, application: Application):
+        index = next(
+            i for i in range(self.count) if self.applications[i] is application
+        )
+        # Park the removed object right after the live applications
+        self.applications.insert(self.count - 1, self.applications.pop(index))
+        self.count -= 1
+
+    def clear(self):
+        # Drop employee references so the buffer does not keep agents alive
+        for application in self.applications:
+            application.employee = None
+        self.count = 0
+
+
 class Seniority(Enum):
     JUNIOR = "junior"
     MIDDLE = "middle"
@@ -33,10 +80,26 @@ class Seniority(Enum):
 
 
 class EmployeeAgent(mesa.Agent):
+    # mesa.Agent still gives instances a __dict__ for unique_id, model and pos,
+    # the model's own fields live in slots
+    __slots__ = (
+        "is_working",
+        "current_salary",
+        "employer_id",
+        "record_index",
+        "settled",
+        "time_in_state",
+        "seniority",
+        "productivity",
+    )
+
     is_working: bool
     current_salary: int | None
     employer_id: int | None
-    work_records: list[WorkRecord]
+    # Row of the latest record in model.work_history, -1 before the first job
+    record_index: int
+    # Already within two cells of the current employer, so move() is a no-op
+    settled: bool
 
     time_in_state: int
 
@@ -52,7 +115,8 @@ class EmployeeAgent(mesa.Agent):
     ):
         super().__init__(unique_id, model)
 
-        self.work_records = []
+        self.record_index = -1
+        self.settled = False
 
         self.time_in_state = 0
         self.is_working = False
@@ -68,19 +132,31 @@ class EmployeeAgent(mesa.Agent):
         self.is_working = not self.is_working
         self.time_in_state = 0
         self.employer_id = employer_id
+        self.settled = False
 
+        now = self.model.schedule.steps
+        work_history = self.model.work_history
         if employer_id is not None:
-            self.work_records.append(
-                WorkRecord(employer_id, salary, self.model.schedule.steps, None)
-            )
+            if self.record_index >= 0:
+                self.model.time_between_jobs_sum += now - int(work_history.to_time[self.record_index])
+                self.model.time_between_jobs_count += 1
+            self.model.employed_count += 1
+            self.record_index = work_history.open(self.unique_id, employer_id, salary, now)
         else:
-            self.work_records[-1].to_time = self.model.schedule.steps
-            self.work_records[-1].salary = self.current_salary
+            work_history.close(self.record_index, now, self.current_salary)
+            self.model.tenure_sum += now - int(work_history.from_time[self.record_index])
+            self.model.tenure_count += 1
+            self.model.employed_count -= 1
         self.current_salary = salary
 
+    @property
+    def work_records(self) -> list[WorkRecord]:
+        return self.model.work_history.records_of(self.unique_id)
+
     def step(self):
-        self.move()
-        logger.debug(f"Employee #{self.unique_id} step")
+        if not self.model.headless:
+            self.move()
+        logger.debug("Employee #%s step", self.unique_id)
         if not self.is_working:
             self._contemplate_working()
             self.time_in_state += 1
@@ -96,40 +172,34 @@ class EmployeeAgent(mesa.Agent):
             self._apply_to_company(selected_company)
 
     def _select_company(self):
-        hiring_companies = list(
-            filter(lambda c: c.accepting_applications, self.model.companies)
-        )
-        if not hiring_companies:
+        if not self.model.hiring_pool:
             return None
-        return self.random.choice(hiring_companies)
+        return self.model.hiring_pool.choice(self.model.uniforms.next())
 
     def _apply_to_company(self, company):
         logger.debug(
-            f"Employee #{self.unique_id} applied to company #{company.unique_id}"
+            "Employee #%s applied to company #%s", self.unique_id, company.unique_id
         )
 
         desired_salary = self._calculate_desired_salary()
-        company.applications.append(Application(self, desired_salary))
+        company.applications.append(self, desired_salary)
 
     def _contemplate_leaving(self) -> bool:
-        leave_probability = leave_probability_f.pdf(self.time_in_state) * self.model.quitting_multiplier
-        if decide_based_on_probability(leave_probability):
+        # Decided for all working employees at once in LaborModel._decide_quits
+        if self in self.model.leaving_employees:
             logger.warning(
-                f"Employee #{self.unique_id} left company #{self.employer_id}"
+                "Employee #%s left company #%s", self.unique_id, self.employer_id
             )
-            # Company unique_id should be the same as their index, might be a YAGNI
-            company = next(
-                filter(lambda c: c.unique_id == self.employer_id, self.model.companies)
-            )
-            company.employees.remove(self)
+            company = self.model.companies_by_id[self.employer_id]
+            company._remove_employee(self)
             self.model.quit_count += 1
             return True
         return False
 
     def _calculate_desired_salary(self) -> int:
-        if not self.work_records:
+        if self.record_index < 0:
             return self.model.initial_salary
-        previous_salary = self.work_records[-1].salary
+        previous_salary = float(self.model.work_history.salary[self.record_index])
 
         # every month he asks for 1% less
         return round(
@@ -137,24 +207,15 @@ class EmployeeAgent(mesa.Agent):
         )
 
     def move(self):
-        employer = next(
-            filter(lambda c: c.unique_id == self.employer_id, self.model.companies),
-            None,
-        )
+        if self.settled:
+            return
+        employer = self.model.companies_by_id.get(self.employer_id)
         if employer:
-            possible_steps = self.model.grid.get_neighborhood(
-                employer.pos, moore=True, include_center=False, radius=1
-            )
-            more_steps = self.model.grid.get_neighborhood(
-                employer.pos, moore=True, include_center=False, radius=2)
-            if self.pos not in possible_steps and self.pos not in more_steps:
-                for position in possible_steps:
-                    if self.model.grid.is_cell_empty(position):
-                        self.model.grid.move_agent(self, position)
-                        return
-                for position in more_steps:
-                    if self.model.grid.is_cell_empty(position):
-                        self.model.grid.move_agent(self, position)
-                        return
-
-
+            if self.pos in employer.nearby_cells:
+                self.settled = True
+                return
+            for position in employer.move_targets:
+                if self.model.grid.is_cell_empty(position):
+                    self.model.grid.move_agent(self, position)
+                    self.settled = True
+                    return
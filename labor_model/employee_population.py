@@ -0,0 +1,286 @@
+from dataclasses import dataclass
+
+import mesa
+import numpy as np
+
+from labor_model.employee_agent import Application, leave_probabilities
+from labor_model.local_logging import logger
+from labor_model.utils import AVERAGE_PRODUCTIVITY, INFLATION_RATE
+
+
+class PopulationMember:
+    # Stands in for an EmployeeAgent whose state lives in EmployeePopulation arrays
+    __slots__ = ("population", "index")
+
+    def __init__(self, population: "EmployeePopulation", index: int):
+        self.population = population
+        self.index = index
+
+    @property
+    def unique_id(self) -> int:
+        return self.population.first_employee_id + self.index
+
+    @property
+    def productivity(self) -> float:
+        return float(self.population.productivity[self.index])
+
+    @property
+    def is_working(self) -> bool:
+        return bool(self.population.is_working[self.index])
+
+    @property
+    def current_salary(self) -> float | None:
+        if not self.is_working:
+            return None
+        return float(self.population.salary[self.index])
+
+
+@dataclass(slots=True)
+class BatchedApplication(Application):
+    position: int
+
+
+class ApplicationBatch:
+    applicants: np.ndarray
+    desired_salaries: np.ndarray
+    pending: np.ndarray
+
+    def __init__(self, applicants: np.ndarray, desired_salaries: np.ndarray):
+        self.applicants = applicants
+        self.desired_salaries = desired_salaries
+        self.pending = np.ones(len(applicants), dtype=bool)
+        self.pending_count = len(applicants)
+
+    def __len__(self) -> int:
+        return self.pending_count
+
+    def remove(self, application: BatchedApplication):
+        if self.pending[application.position]:
+            self.pending[application.position] = False
+            self.pending_count -= 1
+
+    def clear(self):
+        self.pending[:] = False
+        self.pending_count = 0
+
+
+class EmployeePopulation(mesa.Agent):
+    # Struct-of-arrays employee state, stepped as a single agent so that the
+    # schedule keeps the company -> employee -> new company activation order
+    first_employee_id: int
+
+    is_working: np.ndarray
+    employer: np.ndarray
+    salary: np.ndarray
+    productivity: np.ndarray
+    time_in_state: np.ndarray
+
+    last_salary: np.ndarray
+    hired_at: np.ndarray
+    left_at: np.ndarray
+
+    companies: list
+    # Employee indices of the companies that looked up their members once,
+    # kept up to date from then on, so a company that fires every step does
+    # not scan the whole employer array every time
+    members: dict[int, set[int]]
+    indexed: np.ndarray
+    payroll: np.ndarray
+    total_productivity: np.ndarray
+    headcount: np.ndarray
+
+    def __init__(self, unique_id: int, model: mesa.Model, num_employees: int):
+        super().__init__(unique_id, model)
+
+        self.first_employee_id = unique_id
+        self.rng = model.rng
+
+        # [AVERAGE_PRODUCTIVITY - 1, AVERAGE_PRODUCTIVITY + 1]
+        self.productivity = self.rng.uniform(
+            AVERAGE_PRODUCTIVITY - 1, AVERAGE_PRODUCTIVITY + 1, num_employees
+        )
+        self.is_working = np.zeros(num_employees, dtype=bool)
+        self.employer = np.full(num_employees, -1, dtype=np.int64)
+        self.salary = np.zeros(num_employees)
+        self.time_in_state = np.zeros(num_employees, dtype=np.int64)
+
+        self.last_salary = np.zeros(num_employees)
+        self.hired_at = np.zeros(num_employees, dtype=np.int64)
+        # -1 until the employee leaves a job for the first time
+        self.left_at = np.full(num_employees, -1, dtype=np.int64)
+
+        self.companies = []
+        self.members = {}
+        self.indexed = np.zeros(0, dtype=bool)
+        self.payroll = np.zeros(0)
+        self.total_productivity = np.zeros(0)
+        self.headcount = np.zeros(0, dtype=np.int64)
+
+        self.tenure_sum = 0
+        self.tenure_count = 0
+        self.time_between_jobs_sum = 0
+        self.time_between_jobs_count = 0
+
+    def register_company(self, company) -> int:
+        self.companies.append(company)
+        self.indexed = np.append(self.indexed, False)
+        self.payroll = np.append(self.payroll, 0.0)
+        self.total_productivity = np.append(self.total_productivity, 0.0)
+        self.headcount = np.append(self.headcount, 0)
+        return len(self.companies) - 1
+
+    def employ_initial_workforce(self, companies: list, employment_rate: float, jobs_to_employees_ratio: float):
+        # Same greedy fill as the agent path: each company takes employees in
+        # order until its productivity reaches the target, the employee that
+        # overflows it stays unemployed
+        cumulative_productivity = np.concatenate(([0.0], np.cumsum(self.productivity)))
+        num_employees = len(self.productivity)
+        start = 0
+        for company in companies:
+            if start >= num_employees:
+                break
+            target = employment_rate * company.available_sellable_products_count / jobs_to_employees_ratio
+            end = int(np.searchsorted(
+                cumulative_productivity, cumulative_productivity[start] + target, side="left"
+            ))
+            end = min(max(end, start), num_employees)
+            hired = np.arange(start, end)
+            self.is_working[hired] = True
+            self.employer[hired] = company.slot
+            self.salary[hired] = self.model.initial_salary
+            self.hired_at[hired] = self.model.schedule.steps
+            start = end + 1
+        self.refresh_company_totals()
+
+    def step(self):
+        working = np.flatnonzero(self.is_working)
+        job_seekers = np.flatnonzero(~self.is_working)
+
+        leave_probability = (
+            leave_probabilities(self.time_in_state[working])
+            * self.model.quitting_multiplier
+        )
+        leavers = working[self.rng.random(len(working)) < leave_probability]
+
+        self._file_applications(job_seekers)
+
+        self.time_in_state += 1
+        if len(leavers):
+            logger.debug("%s employees left their companies", len(leavers))
+            self.model.quit_count += len(leavers)
+            self.separate(leavers)
+        self.refresh_company_totals()
+
+    def _file_applications(self, job_seekers: np.ndarray):
+        hiring_companies = list(self.model.hiring_pool)
+        if not hiring_companies or not len(job_seekers):
+            return
+
+        desired_salaries = self._calculate_desired_salaries(job_seekers)
+        choices = self.rng.integers(len(hiring_companies), size=len(job_seekers))
+        order = np.argsort(choices, kind="stable")
+        bounds = np.cumsum(np.bincount(choices, minlength=len(hiring_companies)))[:-1]
+
+        for company, applicants, salaries in zip(
+            hiring_companies,
+            np.split(job_seekers[order], bounds),
+            np.split(desired_salaries[order], bounds),
+        ):
+            if len(applicants):
+                company.applications = ApplicationBatch(applicants, salaries)
+
+    def _calculate_desired_salaries(self, job_seekers: np.ndarray) -> np.ndarray:
+        desired_salaries = np.full(len(job_seekers), float(self.model.initial_salary))
+        has_worked = self.left_at[job_seekers] >= 0
+        returning = job_seekers[has_worked]
+        # every month he asks for 1% less
+        desired_salaries[has_worked] = np.round(
+            self.last_salary[returning]
+            * (self.model.changing_jobs_raise - 0.01 * self.time_in_state[returning])
+        )
+        return desired_salaries
+
+    def hire(self, index: int, company, salary: float):
+        now = self.model.schedule.steps
+        if self.left_at[index] >= 0:
+            self.time_between_jobs_sum += int(now - self.left_at[index])
+            self.time_between_jobs_count += 1
+
+        self.is_working[index] = True
+        self.employer[index] = company.slot
+        self.salary[index] = salary
+        self.time_in_state[index] = 0
+        self.hired_at[index] = now
+        if self.indexed[company.slot]:
+            self.members[company.slot].add(int(index))
+
+        self.payroll[company.slot] += salary
+        self.total_productivity[company.slot] += self.productivity[index]
+        self.headcount[company.slot] += 1
+
+    def separate(self, indices: np.ndarray | int):
+        indices = np.atleast_1d(indices)
+        now = self.model.schedule.steps
+        slots = self.employer[indices]
+
+        self.tenure_sum += int(np.sum(now - self.hired_at[indices]))
+        self.tenure_count += len(indices)
+
+        np.subtract.at(self.payroll, slots, self.salary[indices])
+        np.subtract.at(self.total_productivity, slots, self.productivity[indices])
+        np.subtract.at(self.headcount, slots, 1)
+        tracked = self.indexed[slots]
+        if tracked.any():
+            for index, slot in zip(indices[tracked].tolist(), slots[tracked].tolist()):
+                self.members[slot].discard(index)
+
+        self.last_salary[indices] = self.salary[indices]
+        self.left_at[indices] = now
+        self.is_working[indices] = False
+        self.employer[indices] = -1
+        self.salary[indices] = 0
+        self.time_in_state[indices] = 0
+
+    def members_of(self, company) -> np.ndarray:
+        if not self.indexed[company.slot]:
+            members = np.flatnonzero(self.employer == company.slot)
+            self.members[company.slot] = set(members.tolist())
+            self.indexed[company.slot] = True
+            return members
+        # In index order, like a scan of the employer array
+        members = self.members[company.slot]
+        return np.fromiter(sorted(members), dtype=np.int64, count=len(members))
+
+    def least_efficient_member(self, company) -> int:
+        members = self.members_of(company)
+        return int(members[np.argmax(self.salary[members] / self.productivity[members])])
+
+    def apply_yearly_raises(self, companies: list):
+        raising = np.zeros(len(self.companies), dtype=bool)
+        raising[[c.slot for c in companies]] = True
+        working = np.flatnonzero(self.is_working)
+        raised = working[raising[self.employer[working]]]
+        self.salary[raised] *= 1 + INFLATION_RATE
+        self.refresh_company_totals()
+
+    def refresh_company_totals(self):
+        # Rebuilt from scratch once per step so incremental float error does not accumulate
+        working = np.flatnonzero(self.is_working)
+        slots = self.employer[working]
+        size = len(self.companies)
+        self.payroll = np.bincount(slots, weights=self.salary[working], minlength=size)
+        self.total_productivity = np.bincount(slots, weights=self.productivity[working], minlength=size)
+        self.headcount = np.bincount(slots, minlength=size)
+
+    def unemployment_rate(self) -> float:
+        return np.count_nonzero(~self.is_working) / len(self.is_working)
+
+    def average_tenure(self) -> float:
+        if self.tenure_count == 0:
+            return 0
+        return self.tenure_sum / self.tenure_count
+
+    def average_time_between_jobs(self) -> float:
+        if self.time_between_jobs_count == 0:
+            return 0
+        return self.time_between_jobs_sum / self.time_between_jobs_count
@@ -0,0 +1,42 @@
+from typing import Iterator
+
+import mesa
+
+
+class HiringPool:
+    # Companies currently accepting applications. Kept as a list plus an index
+    # so adding, removing and drawing a random company are all O(1).
+    companies: list[mesa.Agent]
+    positions: dict[mesa.Agent, int]
+
+    def __init__(self):
+        self.companies = []
+        self.positions = {}
+
+    def __len__(self) -> int:
+        return len(self.companies)
+
+    def __iter__(self) -> Iterator[mesa.Agent]:
+        return iter(self.companies)
+
+    def __contains__(self, company: mesa.Agent) -> bool:
+        return company in self.positions
+
+    def add(self, company: mesa.Agent):
+        if company in self.positions:
+            return
+        self.positions[company] = len(self.companies)
+        self.companies.append(company)
+
+    def discard(self, company: mesa.Agent):
+        position = self.positions.pop(company, None)
+        if position is None:
+            return
+        last_company = self.companies.pop()
+        if last_company is not company:
+            self.companies[position] = last_company
+            self.positions[last_company] = position
+
+    def choice(self, uniform: float) -> mesa.Agent:
+        # uniform is a [0, 1) draw, so the index is always in range
+        return self.companies[int(uniform * len(self.companies))]
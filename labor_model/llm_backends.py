@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+from hashlib import blake2b
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+from threading import Lock
+from time import sleep, time
+from types import SimpleNamespace
+
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+
+from labor_model.config import Settings
+from labor_model.llm_cache import Messages
+from labor_model.llm_deciding import (HR_BATCH_CHOOSE_PROMPT,
+                                      HR_BATCH_HIRE_FIRE_PROMPT,
+                                      HR_CHOOSE_PROMPT, HR_HIRE_FIRE_PROMPT,
+                                      SELLING_ALL_PROMPT)
+
+EARN_SPEND_PATTERN = re.compile(r"We earned (-?\d+)\$ and spent (-?\d+)\$")
+PERSON_PATTERN = re.compile(r"#(\d+) \((-?[\d.]+), (-?\d+)\)")
+COMPANY_LINE_PATTERN = re.compile(r"Company (\d+): (.*)")
+
+
+class StubLLMError(RuntimeError):
+    pass
+
+
+class StubResponder:
+    # Answers llm_deciding's prompts the way a chat model might, without a
+    # network. Every answer, delay and injected failure is derived from the
+    # seed and the prompt alone, so runs are reproducible however the requests
+    # are ordered or interleaved. malformed_rate of the answers take a shape
+    # the parsers have to recover from or reject.
+    latency: float
+    error_rate: float
+    malformed_rate: float
+    seed: int
+
+    calls: int
+    errors: int
+    in_flight: int
+    max_in_flight: int
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, malformed_rate: float = 0.1, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.seed = seed
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = Lock()
+
+    def _random(self, messages: Messages) -> random.Random:
+        contents = json.dumps([self.seed, *(message["content"] for message in messages)])
+        return random.Random(blake2b(contents.encode(), digest_size=8).digest())
+
+    def delay(self, messages: Messages) -> float:
+        # Uniform around the mean latency
+        return self._random(messages).uniform(0, 2 * self.latency)
+
+    def started(self):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def respond(self, messages: Messages) -> str:
+        rng = self._random(messages)
+        rng.random()  # used by delay
+        if rng.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            raise StubLLMError("Injected LLM error")
+        malformed = rng.random() < self.malformed_rate
+
+        system_prompt, user_prompt = messages[0]["content"], messages[-1]["content"]
+        if system_prompt == HR_HIRE_FIRE_PROMPT:
+            return self._employee_count_answer(rng, user_prompt, malformed)
+        if system_prompt == HR_CHOOSE_PROMPT:
+            return self._choice_answer(rng, user_prompt, malformed)
+        if system_prompt in (HR_BATCH_HIRE_FIRE_PROMPT, HR_BATCH_CHOOSE_PROMPT):
+            return self._batch_answer(rng, system_prompt, user_prompt, malformed)
+        return "I am not sure what you mean."
+
+    def _decision(self, rng: random.Random, prompt: str) -> str:
+        earned, spent = (int(value) for value in EARN_SPEND_PATTERN.search(prompt).groups())
+        if SELLING_ALL_PROMPT in prompt and earned > spent:
+            likely = "Hire"
+        elif SELLING_ALL_PROMPT not in prompt and earned < spent:
+            likely = "Fire"
+        else:
+            likely = "Nothing"
+        return likely if rng.random() < 0.8 else rng.choice(["Hire", "Fire", "Nothing"])
+
+    def _employee_count_answer(self, rng: random.Random, prompt: str, malformed: bool) -> str:
+        decision = self._decision(rng, prompt)
+        if malformed:
+            return rng.choice([f"I would suggest: {decision}", f"{decision.lower()}!", "It depends."])
+        return rng.choice([decision, f"{decision}."])
+
+    def _person(self, rng: random.Random, prompt: str) -> int | None:
+        # Applicants are ranked best first, employees worst first, by
+        # productivity per salary
+        people = [(int(i), float(p), int(s)) for i, p, s in PERSON_PATTERN.findall(prompt)]
+        if not people:
+            return None
+        hiring = "applying" in prompt
+        ranked = sorted(people, key=lambda person: person[1] / max(person[2], 1), reverse=hiring)
+        return ranked[0][0] if rng.random() < 0.7 else rng.choice(people)[0]
+
+    def _choice_answer(self, rng: random.Random, prompt: str, malformed: bool) -> str:
+        person = self._person(rng, prompt)
+        if person is None:
+            return "There is nobody to choose from."
+        if malformed:
+            return rng.choice(["The first one.", f"Number {person + 1000000}", "#"])
+        return rng.choice([f"#{person}", str(person), f"Person #{person}."])
+
+    def _batch_answer(self, rng: random.Random, system_prompt: str, user_prompt: str, malformed: bool) -> str:
+        entries = []
+        for line in user_prompt.split("\n"):
+            match = COMPANY_LINE_PATTERN.match(line)
+            if match is None:
+                continue
+            company_id, company_prompt = int(match.group(1)), match.group(2)
+            if system_prompt == HR_BATCH_HIRE_FIRE_PROMPT:
+                entry = {"company": company_id, "decision": self._decision(rng, company_prompt)}
+            else:
+                entry = {"company": company_id, "person": self._person(rng, company_prompt)}
+            if malformed and rng.random() < 0.3:
+                # Dropped or garbled entries have to be asked again
+                if rng.random() < 0.5:
+                    continue
+                entry = {"company": f"#{company_id}", "decision": "Maybe", "person": "someone"}
+            entries.append(entry)
+
+        answer = json.dumps(entries, indent=rng.choice([None, 2]))
+        if malformed and rng.random() < 0.2:
+            return answer[: len(answer) // 2]
+        return rng.choice([answer, f"```json\n{answer}\n```", f"Here are the decisions:\n{answer}"])
+
+    def completion(self, model: str, messages: Messages) -> ChatCompletion:
+        return ChatCompletion(
+            id=f"chatcmpl-stub-{self.calls}",
+            object="chat.completion",
+            created=int(time()),
+            model=model,
+            choices=[
+                Choice(
+                    index=0,
+                    finish_reason="stop",
+                    message=ChatCompletionMessage(role="assistant", content=self.respond(messages)),
+                )
+            ],
+        )
+
+
+class StubLLMClient:
+    # Drop-in for OpenAI in llm_deciding: client.chat.completions.create
+    is_async = False
+    responder: StubResponder
+
+    def __init__(self, responder: StubResponder | None = None):
+        self.responder = responder or StubResponder()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model: str, messages: Messages, **kwargs) -> ChatCompletion:
+        self.responder.started()
+        try:
+            sleep(self.responder.delay(messages))
+            return self.responder.completion(model, messages)
+        finally:
+            self.responder.finished()
+
+
+class AsyncStubLLMClient:
+    # Drop-in for AsyncOpenAI, see StubLLMClient
+    is_async = True
+    responder: StubResponder
+
+    def __init__(self, responder: StubResponder | None = None):
+        self.responder = responder or StubResponder()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model: str, messages: Messages, **kwargs) -> ChatCompletion:
+        self.responder.started()
+        try:
+            await asyncio.sleep(self.responder.delay(messages))
+            return self.responder.completion(model, messages)
+        finally:
+            self.responder.finished()
+
+
+def create_llm_client(settings: Settings, asynchronous: bool = True):
+    # Settings.llm_backend picks the backend: "openai" or the offline "stub".
+    # open_ai_base_url points the OpenAI client elsewhere, e.g. at serve_stub.
+    if settings.llm_backend == "stub":
+        return AsyncStubLLMClient() if asynchronous else StubLLMClient()
+    if settings.llm_backend != "openai":
+        raise ValueError(f"Unknown LLM backend: '{settings.llm_backend}'")
+    client_class = AsyncOpenAI if asynchronous else OpenAI
+    return client_class(api_key=settings.open_ai_key, base_url=settings.open_ai_base_url)
+
+
+def serve_stub(responder: StubResponder, host: str = "127.0.0.1", port: int = 8000) -> ThreadingHTTPServer:
+    # The chat completions endpoint of the OpenAI API, answered by responder.
+    # Injected errors are returned as HTTP 500, which the OpenAI client retries.
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not self.path.endswith("/chat/completions"):
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            messages = request["messages"]
+            responder.started()
+            try:
+                sleep(responder.delay(messages))
+                self._send(200, responder.completion(request["model"], messages).model_dump(mode="json"))
+            except StubLLMError as e:
+                self._send(500, {"error": {"message": str(e), "type": "server_error"}})
+            finally:
+                responder.finished()
+
+        def _send(self, status: int, body: dict):
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve stub LLM answers on an OpenAI compatible endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean seconds per answer")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    responder = StubResponder(args.latency, args.error_rate, args.malformed_rate, args.seed)
+    server = serve_stub(responder, args.host, args.port)
+    print(f"Serving stub LLM answers at http://{args.host}:{args.port}/v1, set OPEN_AI_BASE_URL to use it")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
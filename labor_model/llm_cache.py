@@ -0,0 +1,97 @@
+from hashlib import blake2b
+import json
+from pathlib import Path
+import sqlite3
+from time import time_ns
+
+Messages = list[dict[str, str]]
+
+
+class ReplayMiss(KeyError):
+    # A replaying cache was asked a prompt that was never recorded: the replay
+    # has diverged from the recorded run, or the recorded request failed.
+    # Unlike other request errors it is not counted as a failed parse, it
+    # ends the replay.
+    pass
+
+
+def prompt_key(model: str, messages: Messages) -> str:
+    contents = [model, *(message["content"] for message in messages)]
+    return blake2b(json.dumps(contents).encode(), digest_size=16).hexdigest()
+
+
+class PromptCache:
+    # LLM responses on disk in SQLite, keyed on the model and the prompts.
+    # The least recently used responses are evicted once there are more than
+    # max_entries. A replaying cache never calls the API: every prompt must
+    # already be recorded, so an LLM run can be repeated offline.
+    path: Path
+    max_entries: int
+    replay: bool
+    hits: int
+    misses: int
+    # Rows in the table, counted once and then kept up to date by put and
+    # _evict. Rows other processes add to a shared file are not counted.
+    entries: int
+
+    def __init__(self, path: Path, max_entries: int = 100_000, replay: bool = False):
+        self.path = Path(path)
+        if replay and not self.path.exists():
+            raise FileNotFoundError(f"No recorded LLM responses at {self.path}")
+        self.max_entries = max_entries
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                messages TEXT NOT NULL,
+                response TEXT NOT NULL,
+                used_at INTEGER NOT NULL
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        self.entries = len(self)
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, model: str, messages: Messages) -> str | None:
+        key = prompt_key(model, messages)
+        row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            if self.replay:
+                raise ReplayMiss(f"No recorded response for '{messages[-1]['content']}'")
+            return None
+
+        self.hits += 1
+        # Replaying leaves the recording untouched
+        if not self.replay:
+            self.connection.execute("UPDATE responses SET used_at = ? WHERE key = ?", (time_ns(), key))
+        return row[0]
+
+    def put(self, model: str, messages: Messages, response: str):
+        # Of two concurrent requests for one prompt the first stored response wins
+        self.entries += self.connection.execute(
+            "INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?, ?)",
+            (prompt_key(model, messages), model, json.dumps(messages), response, time_ns()),
+        ).rowcount
+        if self.entries > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        self.entries -= self.connection.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used_at LIMIT ?)",
+            (self.entries - self.max_entries,),
+        ).rowcount
@@ -1,6 +1,12 @@
+import asyncio
+from contextlib import nullcontext
+from dataclasses import dataclass
 from enum import Enum
-from openai import OpenAI
+import json
+from typing import AsyncContextManager, Callable
+from openai import AsyncOpenAI, OpenAI
 from labor_model.employee_agent import Application, EmployeeAgent
+from labor_model.llm_cache import Messages, PromptCache
 from labor_model.local_logging import logger
 
 # MODEL = "gpt-3.5-turbo-0125"
@@ -19,75 +25,114 @@ HR_CHOOSE_PROMPT = "You are an HR assistant. Your answer to each question should
 LIST_WORKER_PROMPT = "These people are working in our company. Who to let go? Here are their (productivity, salary)"
 LIST_APPLICANTS_PROMPT = "These people are applying to our company. Who to hire? Here are their (productivity, desired salary)"
 
+# Batched mode asks about every company in one prompt
+HR_BATCH_HIRE_FIRE_PROMPT = "You are an HR assistant for several companies. Hiring costs 1500. For each company decide 'Hire', 'Fire' or 'Nothing'. Answer only with a JSON array of objects like {\"company\": 1, \"decision\": \"Nothing\"}, one per company."
+HR_BATCH_CHOOSE_PROMPT = "You are an HR assistant for several companies. For each company choose one person. Answer only with a JSON array of objects like {\"company\": 1, \"person\": 42}, one per company."
+BATCH_HIRE_FIRE_QUESTION_PROMPT = "What should each company do?"
+BATCH_LIST_WORKER_PROMPT = "These people are working in the company. Who to let go? Here are their (productivity, salary)"
+BATCH_LIST_APPLICANTS_PROMPT = "These people are applying to the company. Who to hire? Here are their (productivity, desired salary)"
+
+# Wraps every API request of the async askers, e.g. to limit concurrency
+Throttle = Callable[[], AsyncContextManager]
+NOT_THROTTLED: Throttle = nullcontext
+
 class Decision(Enum):
     HIRE = "Hire"
     FIRE = "Fire"
     NOTHING = "Nothing"
 
-def ask_about_employee_count(client: OpenAI, funds: int, selling_all: bool, earned: int, spent: int) -> bool:
+@dataclass
+class CompanyMonth:
+    company_id: int
+    funds: int
+    selling_all: bool
+    earned: int
+    spent: int
+
+def _complete(client: OpenAI | None, messages: Messages, cache: PromptCache | None = None) -> str:
+    if cache is not None and (response_content := cache.get(MODEL, messages)) is not None:
+        return response_content
+    response = client.chat.completions.create(model=MODEL, messages=messages)
+    response_content = response.choices[0].message.content
+    logger.debug("Question: '%s'.\nAnswer: '%s'", messages[-1]["content"], response_content)
+    if cache is not None:
+        cache.put(MODEL, messages, response_content)
+    return response_content
+
+def is_async_client(client) -> bool:
+    # AsyncOpenAI, or a stand-in with the same interface, see llm_backends
+    return getattr(client, "is_async", isinstance(client, AsyncOpenAI))
+
+async def _complete_async(client: AsyncOpenAI | OpenAI, messages: Messages, cache: PromptCache | None = None, throttle: Throttle = NOT_THROTTLED) -> str:
+    if cache is not None and (response_content := cache.get(MODEL, messages)) is not None:
+        return response_content
+    # Cached answers do not count against the rate limit
+    async with throttle():
+        if is_async_client(client):
+            response = await client.chat.completions.create(model=MODEL, messages=messages)
+        else:
+            response = await asyncio.to_thread(client.chat.completions.create, model=MODEL, messages=messages)
+    response_content = response.choices[0].message.content
+    logger.debug("Question: '%s'.\nAnswer: '%s'", messages[-1]["content"], response_content)
+    if cache is not None:
+        cache.put(MODEL, messages, response_content)
+    return response_content
+
+def employee_count_messages(funds: int, selling_all: bool, earned: int, spent: int) -> Messages:
     selling_prompt = SELLING_ALL_PROMPT if selling_all else PRODUCING_TOO_MUCH_PROMPT
     user_prompt = f"{FUNDS_PROMPT_F(funds)}. {EARN_SPEND_PROMPT_F(earned, spent)}. {selling_prompt}. {HIRE_FIRE_QUESTION_PROMPT}"
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[
-            {"role": "system", "content": HR_HIRE_FIRE_PROMPT},
-            {
-                "role": "user",
-                "content": user_prompt,
-            },
-        ],
-    )
-    response_content = response.choices[0].message.content
-    logger.debug(f"Question: '{user_prompt}'.\nAnswer: '{response_content}'")
+    return [
+        {"role": "system", "content": HR_HIRE_FIRE_PROMPT},
+        {
+            "role": "user",
+            "content": user_prompt,
+        },
+    ]
+
+def parse_employee_count(response_content: str) -> Decision:
     response_content = response_content.replace(".", "")
     return Decision(response_content)
 
-def ask_which_to_hire(client: OpenAI, funds: int, applicants: list[Application]) -> bool:
+def which_to_hire_messages(funds: int, applicants: list[Application]) -> Messages:
     application_list = "; ".join(f"#{a.employee.unique_id} ({round(a.employee.productivity, 1)}, {int(a.desired_salary)})" for a in applicants)
     user_prompt = f"{FUNDS_PROMPT_F(funds)}. {LIST_APPLICANTS_PROMPT}: {application_list}"
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[
-            {"role": "system", "content": HR_CHOOSE_PROMPT},
-            {"role": "user", "content": user_prompt},
-        ],
-    )
-    response_content = response.choices[0].message.content
-    logger.debug(f"Question: '{user_prompt}'.\nAnswer: '{response_content}'")
+    return [
+        {"role": "system", "content": HR_CHOOSE_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+def parse_which_to_hire(response_content: str, applicants: list[Application]) -> Application:
     response_content = response_content.replace(".", "")
 
     try:
         employee_id_str = response_content[response_content.find("#")+1:]
         employee_id = [int(s) for s in employee_id_str.split() if s.isdigit()][0]
     except:
-        logger.warning(f"Failed to parse application id from response: '{response_content}'")
+        logger.warning("Failed to parse application id from response: '%s'", response_content)
         employee_id = [int(s) for s in response_content.split() if s.isdigit()][0]
 
     try:
         application = next(a for a in applicants if a.employee.unique_id == employee_id)
     except StopIteration:
-        logger.warning(f"Failed to find application: '{response_content}'")
+        logger.warning("Failed to find application: '%s'", response_content)
         application = applicants[(employee_id - 1) % len(applicants)]
     return application
 
-def ask_which_to_fire(client: OpenAI, employees: list[EmployeeAgent]) -> EmployeeAgent:
+def which_to_fire_messages(employees: list[EmployeeAgent]) -> Messages:
     employees_list = "; ".join(f"#{e.unique_id} ({round(e.productivity, 1)}, {int(e.current_salary)})" for e in employees)
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[
-            {"role": "system", "content": HR_CHOOSE_PROMPT},
-            {"role": "user", "content": f"{LIST_WORKER_PROMPT}: {employees_list}"},
-        ],
-    )
-    response_content = response.choices[0].message.content
-    logger.debug(f"Question: '{LIST_WORKER_PROMPT}: {employees_list}'.\nAnswer: '{response_content}'")
+    return [
+        {"role": "system", "content": HR_CHOOSE_PROMPT},
+        {"role": "user", "content": f"{LIST_WORKER_PROMPT}: {employees_list}"},
+    ]
+
+def parse_which_to_fire(response_content: str, employees: list[EmployeeAgent]) -> EmployeeAgent:
     response_content = response_content.replace(".", "")
 
     try:
         employee_id_str = response_content[response_content.find("#")+1:]
         employee_id = [int(s) for s in employee_id_str.split() if s.isdigit()][0]
     except:
-        logger.warning(f"Failed to parse employee id from response: '{response_content}'")
+        logger.warning("Failed to parse employee id from response: '%s'", response_content)
         employee_id = [int(s) for s in response_content.split() if s.isdigit()][0]
 
     try:
@@ -95,3 +140,109 @@ def ask_which_to_fire(client: OpenAI, employees: list[EmployeeAgent]) -> Employe
     except StopIteration:
         employee = employees[(employee_id - 1) % len(employees)]
     return employee
+
+def ask_about_employee_count(client: OpenAI | None, funds: int, selling_all: bool, earned: int, spent: int, cache: PromptCache | None = None) -> Decision:
+    messages = employee_count_messages(funds, selling_all, earned, spent)
+    return parse_employee_count(_complete(client, messages, cache))
+
+def ask_which_to_hire(client: OpenAI | None, funds: int, applicants: list[Application], cache: PromptCache | None = None) -> Application:
+    messages = which_to_hire_messages(funds, applicants)
+    return parse_which_to_hire(_complete(client, messages, cache), applicants)
+
+def ask_which_to_fire(client: OpenAI | None, employees: list[EmployeeAgent], cache: PromptCache | None = None) -> EmployeeAgent:
+    messages = which_to_fire_messages(employees)
+    return parse_which_to_fire(_complete(client, messages, cache), employees)
+
+async def ask_about_employee_count_async(client: AsyncOpenAI, funds: int, selling_all: bool, earned: int, spent: int, cache: PromptCache | None = None, throttle: Throttle = NOT_THROTTLED) -> Decision:
+    messages = employee_count_messages(funds, selling_all, earned, spent)
+    return parse_employee_count(await _complete_async(client, messages, cache, throttle))
+
+async def ask_which_to_hire_async(client: AsyncOpenAI, funds: int, applicants: list[Application], cache: PromptCache | None = None, throttle: Throttle = NOT_THROTTLED) -> Application:
+    messages = which_to_hire_messages(funds, applicants)
+    return parse_which_to_hire(await _complete_async(client, messages, cache, throttle), applicants)
+
+async def ask_which_to_fire_async(client: AsyncOpenAI, employees: list[EmployeeAgent], cache: PromptCache | None = None, throttle: Throttle = NOT_THROTTLED) -> EmployeeAgent:
+    messages = which_to_fire_messages(employees)
+    return parse_which_to_fire(await _complete_async(client, messages, cache, throttle), employees)
+
+def _company_prompt(month: CompanyMonth) -> str:
+    selling_prompt = SELLING_ALL_PROMPT if month.selling_all else PRODUCING_TOO_MUCH_PROMPT
+    return f"Company {month.company_id}: {FUNDS_PROMPT_F(month.funds)}. {EARN_SPEND_PROMPT_F(month.earned, month.spent)}. {selling_prompt}."
+
+def employee_counts_messages(months: list[CompanyMonth]) -> Messages:
+    company_prompts = "\n".join(_company_prompt(month) for month in months)
+    return [
+        {"role": "system", "content": HR_BATCH_HIRE_FIRE_PROMPT},
+        {"role": "user", "content": f"{company_prompts}\n{BATCH_HIRE_FIRE_QUESTION_PROMPT}"},
+    ]
+
+def _parse_json_array(response_content: str) -> list[dict]:
+    # Models often wrap the array in a code block or a sentence
+    start, end = response_content.find("["), response_content.rfind("]")
+    if start == -1 or end < start:
+        raise ValueError(f"No JSON array in response: '{response_content}'")
+    entries = json.loads(response_content[start:end + 1])
+    if not isinstance(entries, list):
+        raise ValueError(f"Response is not a JSON array: '{response_content}'")
+    return [entry for entry in entries if isinstance(entry, dict)]
+
+def _parse_id(value) -> int | None:
+    # Accepts 42, "42" and "#42"
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lstrip("#").isdigit():
+        return int(value.strip().lstrip("#"))
+    return None
+
+def parse_employee_counts(response_content: str, company_ids: set[int]) -> dict[int, Decision]:
+    # Only valid entries of the asked companies are returned, the rest have
+    # to be asked again one by one
+    decisions = {}
+    for entry in _parse_json_array(response_content):
+        company_id, decision = _parse_id(entry.get("company")), entry.get("decision")
+        if isinstance(decision, str):
+            decision = decision.replace(".", "")
+        if company_id in company_ids and company_id not in decisions and decision in Decision._value2member_map_:
+            decisions[company_id] = Decision(decision)
+    return decisions
+
+def which_to_choose_messages(applicants: dict[int, tuple[int, list[Application]]], employees: dict[int, list[EmployeeAgent]]) -> Messages:
+    company_prompts = [
+        f"Company {company_id}: {FUNDS_PROMPT_F(funds)}. {BATCH_LIST_APPLICANTS_PROMPT}: "
+        + "; ".join(f"#{a.employee.unique_id} ({round(a.employee.productivity, 1)}, {int(a.desired_salary)})" for a in company_applicants)
+        for company_id, (funds, company_applicants) in applicants.items()
+    ]
+    company_prompts += [
+        f"Company {company_id}: {BATCH_LIST_WORKER_PROMPT}: "
+        + "; ".join(f"#{e.unique_id} ({round(e.productivity, 1)}, {int(e.current_salary)})" for e in company_employees)
+        for company_id, company_employees in employees.items()
+    ]
+    return [
+        {"role": "system", "content": HR_BATCH_CHOOSE_PROMPT},
+        {"role": "user", "content": "\n".join(company_prompts)},
+    ]
+
+def parse_choices(response_content: str, applicants: dict[int, tuple[int, list[Application]]], employees: dict[int, list[EmployeeAgent]]) -> dict[int, Application | EmployeeAgent]:
+    candidates = {
+        company_id: {a.employee.unique_id: a for a in company_applicants}
+        for company_id, (_, company_applicants) in applicants.items()
+    }
+    candidates |= {
+        company_id: {e.unique_id: e for e in company_employees}
+        for company_id, company_employees in employees.items()
+    }
+
+    choices = {}
+    for entry in _parse_json_array(response_content):
+        company_id, person = _parse_id(entry.get("company")), _parse_id(entry.get("person"))
+        if company_id in candidates and company_id not in choices and person in candidates[company_id]:
+            choices[company_id] = candidates[company_id][person]
+    return choices
+
+async def ask_about_employee_counts_async(client: AsyncOpenAI | OpenAI, months: list[CompanyMonth], cache: PromptCache | None = None, throttle: Throttle = NOT_THROTTLED) -> dict[int, Decision]:
+    messages = employee_counts_messages(months)
+    return parse_employee_counts(await _complete_async(client, messages, cache, throttle), {month.company_id for month in months})
+
+async def ask_which_to_choose_async(client: AsyncOpenAI | OpenAI, applicants: dict[int, tuple[int, list[Application]]], employees: dict[int, list[EmployeeAgent]], cache: PromptCache | None = None, throttle: Throttle = NOT_THROTTLED) -> dict[int, Application | EmployeeAgent]:
+    messages = which_to_choose_messages(applicants, employees)
+    return parse_choices(await _complete_async(client, messages, cache, throttle), applicants, employees)
@@ -0,0 +1,241 @@
+import asyncio
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable
+
+from openai import AsyncOpenAI, OpenAI
+
+from labor_model.employee_agent import Application, EmployeeAgent
+from labor_model.llm_cache import PromptCache, ReplayMiss
+from labor_model.llm_deciding import (CompanyMonth, Decision,
+                                      ask_about_employee_count_async,
+                                      ask_about_employee_counts_async,
+                                      ask_which_to_choose_async,
+                                      ask_which_to_fire_async,
+                                      ask_which_to_hire_async)
+from labor_model.local_logging import logger
+
+if TYPE_CHECKING:
+    from labor_model.company_llm_agent import CompanyLLMAgent
+
+
+class TokenBucket:
+    # Lets requests through at `rate` per second on average, with bursts of up
+    # to `capacity` requests after an idle period
+    rate: float
+    capacity: float
+    tokens: float
+    updated_at: float
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = monotonic()
+
+    async def acquire(self):
+        while True:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LLMDecisionEngine:
+    # Steps a group of CompanyLLMAgents together: every company's question of
+    # a round is sent at once, and the answers are applied in company order
+    # after the whole round has returned, so results do not depend on which
+    # response arrives first.
+    # Batched engines ask about all companies in one request per round and
+    # only fall back to per-company requests for unusable answers. A sync
+    # client's requests run in threads.
+    client: AsyncOpenAI | OpenAI | None
+    cache: PromptCache | None
+    batched: bool
+    bucket: TokenBucket
+
+    def __init__(
+        self,
+        client: AsyncOpenAI | OpenAI | None,
+        max_concurrency: int = 8,
+        requests_per_second: float = 5.0,
+        cache: PromptCache | None = None,
+        batched: bool = False,
+    ):
+        self.client = client
+        self.cache = cache
+        self.batched = batched
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(requests_per_second, max_concurrency)
+        # The client's connection pool belongs to one event loop, so every
+        # step runs on the same loop
+        self.loop = asyncio.new_event_loop()
+        self.semaphore = None
+
+    def close(self):
+        # What asyncio.Runner.close does: a sync client's requests run on the
+        # loop's default executor, whose threads are joined first
+        if self.loop.is_closed():
+            return
+        try:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        finally:
+            self.loop.close()
+
+    # The client, cache and event loop are not part of a checkpoint,
+    # load_checkpoint reattaches the client and cache
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state.update(client=None, cache=None, loop=None, semaphore=None)
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.loop = asyncio.new_event_loop()
+        # monotonic() is per process
+        self.bucket.updated_at = monotonic()
+
+    def step_companies(self, companies: list["CompanyLLMAgent"]):
+        self.loop.run_until_complete(self._step_companies(companies))
+
+    @asynccontextmanager
+    async def _throttle(self) -> AsyncIterator[None]:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            await self.bucket.acquire()
+            yield
+
+    async def _request(self, company: "CompanyLLMAgent", name: str, request: Awaitable):
+        with company.model.profile_span(name, "llm"):
+            return await request
+
+    async def _step_companies(self, companies: list["CompanyLLMAgent"]):
+        months = [company._settle_month() for company in companies]
+
+        asking = {
+            company: CompanyMonth(company.unique_id, company.funds, selling_all, earnings, operating_cost)
+            for company, (selling_all, earnings, operating_cost) in zip(companies, months)
+            if company.previous_decision != Decision.HIRE
+        }
+        answers = await self._ask_about_employee_counts(asking)
+        decisions = dict.fromkeys(companies, Decision.HIRE)
+        for company, answer in answers.items():
+            decisions[company] = company._employment_decision_from(answer)
+
+        hiring, firing = [], []
+        for company in companies:
+            if decisions[company] == Decision.HIRE and company.applications:
+                hiring.append(company)
+            elif decisions[company] == Decision.FIRE:
+                firing.append(company)
+        chosen = await self._ask_which_to_choose(hiring, firing)
+
+        # Recording a decision changes the hiring pool, so it is done here
+        # company by company, in the order the sequential path would use
+        for company in companies:
+            company._record_employment_decision(decisions[company])
+            if company in hiring:
+                company._hire_chosen_application(chosen[company])
+            elif company in firing:
+                company._fire_chosen_employee(chosen[company])
+            company.applications.clear()
+
+    async def _ask_about_employee_counts(
+        self, asking: dict["CompanyLLMAgent", CompanyMonth]
+    ) -> dict["CompanyLLMAgent", Decision | Exception]:
+        answers = {}
+        if self.batched and asking:
+            answers = await self._ask_batch(
+                asking,
+                "ask_about_employee_counts",
+                ask_about_employee_counts_async(self.client, list(asking.values()), self.cache, self._throttle),
+            )
+
+        # Companies missing from the batched answer are asked one by one
+        single = [company for company in asking if company not in answers]
+        single_answers = await asyncio.gather(
+            *(
+                self._request(
+                    company,
+                    "ask_about_employee_count",
+                    ask_about_employee_count_async(
+                        self.client,
+                        month.funds,
+                        month.selling_all,
+                        month.earned,
+                        month.spent,
+                        self.cache,
+                        self._throttle,
+                    ),
+                )
+                for company, month in ((company, asking[company]) for company in single)
+            ),
+            return_exceptions=True,
+        )
+        answers.update(zip(single, single_answers))
+        return {company: answers[company] for company in asking}
+
+    async def _ask_which_to_choose(
+        self, hiring: list["CompanyLLMAgent"], firing: list["CompanyLLMAgent"]
+    ) -> dict["CompanyLLMAgent", Application | EmployeeAgent | Exception]:
+        chosen = {}
+        if self.batched and (hiring or firing):
+            chosen = await self._ask_batch(
+                hiring + firing,
+                "ask_which_to_choose",
+                ask_which_to_choose_async(
+                    self.client,
+                    {company.unique_id: (company.funds, list(company.applications)) for company in hiring},
+                    {company.unique_id: list(company.employees) for company in firing},
+                    self.cache,
+                    self._throttle,
+                ),
+            )
+
+        single_hiring = [company for company in hiring if company not in chosen]
+        single_firing = [company for company in firing if company not in chosen]
+        choices = await asyncio.gather(
+            *(
+                self._request(
+                    company,
+                    "ask_which_to_hire",
+                    ask_which_to_hire_async(
+                        self.client, company.funds, list(company.applications), self.cache, self._throttle
+                    ),
+                )
+                for company in single_hiring
+            ),
+            *(
+                self._request(
+                    company,
+                    "ask_which_to_fire",
+                    ask_which_to_fire_async(
+                        self.client, list(company.employees), self.cache, self._throttle
+                    ),
+                )
+                for company in single_firing
+            ),
+            return_exceptions=True,
+        )
+        chosen.update(zip(single_hiring + single_firing, choices))
+        return chosen
+
+    async def _ask_batch(self, companies, name: str, request: Awaitable[dict[int, object]]) -> dict:
+        # A batched answer covers the companies it has a valid entry for. The
+        # others are asked one by one, and only the outcome of that request
+        # counts towards their parses, so every decision is counted once.
+        model = next(iter(companies)).model
+        try:
+            with model.profile_span(name, "llm"):
+                answers = await request
+        except ReplayMiss:
+            raise
+        except Exception as e:
+            logger.error("Error in batched request %s. %s", name, e)
+            answers = {}
+        return {company: answers[company.unique_id] for company in companies if company.unique_id in answers}
@@ -1,11 +1,11 @@
 import logging
+from pathlib import Path
 
-from openai import OpenAI
-
-from random import seed
-from numpy.random import seed as np_seed
+import numpy as np
 
 from labor_model.config import Settings
+from labor_model.llm_backends import create_llm_client
+from labor_model.llm_cache import PromptCache
 from labor_model.local_logging import logger
 from labor_model.model import LaborModel
 from labor_model.stats import StepStatsCalculator, print_company_stats, print_employee_stats, print_unemployment_stats
@@ -15,26 +15,40 @@ def main():
     logger.setLevel(logging.WARNING)
     settings = Settings()
 
-    # To fix the results
-    # seed(1)
-    # np_seed(1)
+    # To fix the results pass a fixed seed to LaborModel
 
     NUM_EMPLOYEES = 95
     NUM_COMPANIES = 9
     llm_based = True
-    open_ai_client = OpenAI(api_key=settings.open_ai_key) if llm_based else None
-    model = LaborModel(NUM_EMPLOYEES, NUM_COMPANIES, settings, llm_based, open_ai_client)
+    # Replaying the last run offline from the answers it recorded in
+    # llm_cache.sqlite, with the seed it saved in llm_cache.seed
+    replay = False
+    seed_path = Path("llm_cache.seed")
+    if replay:
+        seed = int(seed_path.read_text())
+    else:
+        seed = np.random.SeedSequence().entropy
+        if llm_based:
+            seed_path.write_text(str(seed))
+    llm_cache = PromptCache(Path("llm_cache.sqlite"), replay=replay) if llm_based else None
+    open_ai_client = create_llm_client(settings) if llm_based and not replay else None
+    model = LaborModel(
+        NUM_EMPLOYEES, NUM_COMPANIES, settings, llm_based, open_ai_client, llm_cache=llm_cache, seed=seed
+    )
     stats = StepStatsCalculator(model)
 
     MODEL_STEPS = 120
     for _ in range(MODEL_STEPS):
         model.step()
         stats.step()
+    model.close()
 
     successful_parses = sum(company.parses_succeeded for company in model.companies)
     failed_parses = sum(company.parses_failed for company in model.companies)
 
     print(f"Failed parses {failed_parses / (successful_parses + failed_parses)} out of {successful_parses + failed_parses}")
+    if llm_cache:
+        print(f"LLM cache hits {llm_cache.hits}, misses {llm_cache.misses}")
     profits = stats.get_total_profits()
     print_company_stats(model.companies, profits)
     print(f"Unemployment rates: {stats.unemployment_rates}")
@@ -43,7 +57,7 @@ def main():
     # print(f"Total funds: {stats.total_funds}")
     # print(f"Fill rates: {stats.product_fill_rates}")
     print_unemployment_stats(stats.unemployment_rates)
-    print_employee_stats(model.employees)
+    print_employee_stats(model.work_history)
 
     change_count = model.quit_count + model.fire_count
     print(f"Quit percentage: {model.quit_count / change_count:.2}")
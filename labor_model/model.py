@@ -1,44 +1,96 @@
-from random import random
+from contextlib import AbstractContextManager, nullcontext
+from functools import partial
 from time import sleep
+from typing import Callable
 
 import mesa
 import numpy as np
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 from labor_model.company_agent import CompanyAgent
 from labor_model.company_llm_agent import CompanyLLMAgent
+from labor_model.company_population_agent import CompanyPopulationAgent
 from labor_model.config import Settings
-from labor_model.employee_agent import EmployeeAgent, Seniority
+from labor_model.early_stop import EarlyStop
+from labor_model.employee_agent import (EmployeeAgent, Seniority,
+                                        leave_probabilities)
+from labor_model.employee_population import EmployeePopulation
+from labor_model.hiring_pool import HiringPool
+from labor_model.llm_cache import PromptCache
+from labor_model.llm_deciding import is_async_client
+from labor_model.llm_engine import LLMDecisionEngine
 from labor_model.local_logging import logger
+from labor_model.profiler import ProfiledActivation, Profiler
+from labor_model.scheduled_phase import ScheduledPhase
 from labor_model.step_stats_collector import StepStatsCollector
+from labor_model.work_history import WorkHistory
 from labor_model.utils import (AVERAGE_PRODUCTIVITY, INFLATION_RATE,
-                               JOBS_TO_EMPLOYEES_RATIO)
+                               JOBS_TO_EMPLOYEES_RATIO, UniformDraws)
+
+# Returned by LaborModel.profile_span when profiling is off
+NOT_PROFILED = nullcontext()
+
+# Settings that only shape the initial economy, see LaborModel.apply_settings
+CONSTRUCTION_SETTINGS = {"initial_product_cost", "initial_employment_rate"}
 
 
 class LaborModel(mesa.Model):
     agent_id_iter: int
+    phase_count: int
 
     product_cost: float
     company_operating_cost: int
     cost_per_hire: int
 
     employees: list[EmployeeAgent]
+    work_history: WorkHistory
+    population: EmployeePopulation | None
     companies: list[CompanyAgent]
+    companies_by_id: dict[int, CompanyAgent]
+    hiring_pool: HiringPool
     bankrupt_companies: list[CompanyAgent]
-
+    # Every CompanyLLMAgent ever created, bankrupt ones keep stepping
+    llm_companies: list[CompanyLLMAgent]
+    llm_engine: LLMDecisionEngine | None
+    llm_cache: PromptCache | None
+    early_stop: EarlyStop | None
+    stop_reason: str | None
+
+    profiler: Profiler | None
+    rng: np.random.Generator
+    uniforms: UniformDraws
+
+    leaving_employees: set[EmployeeAgent]
     quit_count: int
     fire_count: int
 
+    # Running totals kept by EmployeeAgent.change_work_state for the collector
+    employed_count: int
+    tenure_sum: int
+    tenure_count: int
+    time_between_jobs_sum: int
+    time_between_jobs_count: int
+
     def __init__(
         self,
         num_employees: int,
         num_companies: int,
         settings: Settings,
         llm_based: bool = False,
-        open_ai_client: OpenAI | None = None,
+        open_ai_client: OpenAI | AsyncOpenAI | None = None,
         quitting_multiplier: float | None = None,
         product_cost: int | None = None,
         initial_employment_rate: float | None = None,
+        vectorized: bool = False,
+        check_totals: bool = False,
+        headless: bool = False,
+        profile: bool = False,
+        seed: int | np.random.SeedSequence | None = None,
+        llm_concurrency: int = 8,
+        llm_requests_per_second: float = 5.0,
+        llm_cache: PromptCache | None = None,
+        llm_batched: bool = False,
+        early_stop: EarlyStop | None = None,
     ):
         # https://www.payscale.com/content/report/2024-compensation-best-practice-report.pdf
         # 3% is the average base pay increase predicted for 2024
@@ -48,24 +100,38 @@ class LaborModel(mesa.Model):
         # Changing jobs results in around 10% salary increase
         super().__init__()
 
-        self.grid = mesa.space.MultiGrid(19, 19, True)
+        # Every random draw in the model comes from this generator, so equal
+        # seeds give identical runs. Batch runs pass SeedSequence children.
+        self.rng = np.random.default_rng(seed)
+        self.reseed(seed)
+
+        # Batch runs never render the grid, so headless models skip spatial
+        # placement and employee movement entirely
+        self.headless = headless
+        self.grid = None if headless else mesa.space.MultiGrid(19, 19, True)
 
+        if llm_based and vectorized:
+            raise ValueError("The vectorized engine does not support LLM based companies")
         self.llm_based = llm_based
+        # Answers are looked up here before asking open_ai_client. A replaying
+        # cache needs no client at all.
+        self.llm_cache = llm_cache
+        self.vectorized = vectorized
+        # Debug mode: compare the companies' running payroll and productivity
+        # totals against a full recompute after every step
+        self.check_totals = check_totals
+        # Checked after every collection. A run it stops records why in
+        # stop_reason and sets running to False.
+        self.early_stop = early_stop
+        self.stop_reason = None
 
         if product_cost:
             self.product_cost = product_cost
         else:
             self.product_cost = settings.initial_product_cost
-        self.company_operating_cost = settings.base_operating_cost
-        self.cost_per_hire = settings.cost_per_hire
-        self.initial_salary = settings.initial_salary
-        self.changing_jobs_raise = settings.changing_jobs_raise
+        self.apply_settings(settings)
         if quitting_multiplier:
             self.quitting_multiplier = quitting_multiplier
-        else:
-            self.quitting_multiplier = settings.quitting_multiplier
-        self.company_fire_probability = settings.company_fire_probability
-        self.company_emergency_months = settings.company_emergency_months
         if initial_employment_rate:
             self.initial_employment_rate = initial_employment_rate
         else:
@@ -77,15 +143,53 @@ class LaborModel(mesa.Model):
 
         self.num_companies = num_companies
         self.num_employees = num_employees
+        # Records phase, agent type and LLM call timings, see profile_span
+        self.profiler = Profiler() if profile else None
         # Gal random activation? Nes dabar kai kurie advantaged yra
-        self.schedule = mesa.time.SimultaneousActivation(self)
+        if profile:
+            self.schedule = ProfiledActivation(self, self.profiler)
+        else:
+            self.schedule = mesa.time.SimultaneousActivation(self)
+        self.phase_count = 0
         self.companies = []
+        self.companies_by_id = {}
+        self.hiring_pool = HiringPool()
         self.bankrupt_companies = []
+        self.llm_companies = []
         self.employees = []
+        self.work_history = WorkHistory()
 
+        self.leaving_employees = set()
         self.quit_count = 0
         self.fire_count = 0
 
+        self.employed_count = 0
+        self.tenure_sum = 0
+        self.tenure_count = 0
+        self.time_between_jobs_sum = 0
+        self.time_between_jobs_count = 0
+
+        # Employees are kept as NumPy arrays and stepped in one batch instead
+        # of one EmployeeAgent per employee
+        self.population = (
+            EmployeePopulation(self.num_companies, self, self.num_employees)
+            if vectorized
+            else None
+        )
+
+        # With an async client the LLM companies' questions are sent
+        # concurrently instead of one blocking call after another. Batched
+        # mode asks about all companies at once with any client.
+        self.llm_engine = (
+            LLMDecisionEngine(
+                open_ai_client, llm_concurrency, llm_requests_per_second, llm_cache, llm_batched
+            )
+            if llm_based and (is_async_client(open_ai_client) or llm_batched)
+            else None
+        )
+        if self.llm_engine:
+            self._add_phase(partial(self._step_llm_companies, False), "llm_companies")
+
         initial_market_shares = self.get_initial_market_shares()
         for i in range(self.num_companies):
             company_available_products = int(
@@ -93,7 +197,15 @@ class LaborModel(mesa.Model):
             )
             company_funds = company_available_products * self.product_cost * 3
 
-            if llm_based:
+            if vectorized:
+                c = CompanyPopulationAgent(
+                    i,
+                    self,
+                    initial_market_shares[i],
+                    company_available_products,
+                    company_funds,
+                )
+            elif llm_based:
                 c = CompanyLLMAgent(
                     i,
                     self,
@@ -110,71 +222,132 @@ class LaborModel(mesa.Model):
                     company_available_products,
                     company_funds,
                 )
-            self.companies.append(c)
-            self.schedule.add(c)
-            self._place_company(c)
+            self._add_company(c)
 
-        current_companies_idx = 0
-        for i in range(self.num_companies, self.num_employees + self.num_companies):
-            employee_productivity = self._generate_employee_productivity_ratio()
-            e = EmployeeAgent(i, self, Seniority.JUNIOR, employee_productivity)
-            self.employees.append(e)
-            self.schedule.add(e)
-            self._place_agent(e)
-
-            if current_companies_idx < len(self.companies):
-                current_company = self.companies[current_companies_idx]
-                current_company_productivity = (
-                    current_company._calculate_total_productivity()
-                )
-                if (
-                    current_company_productivity
-                    < self.initial_employment_rate
-                    * current_company.available_sellable_products_count
-                    / JOBS_TO_EMPLOYEES_RATIO
-                ):
-                    current_company.employees.append(e)
-                    e.change_work_state(current_company.unique_id, self.initial_salary)
-                else:
-                    current_companies_idx += 1
+        if vectorized:
+            self.schedule.add(self.population)
+            self.population.employ_initial_workforce(
+                self.companies, self.initial_employment_rate, JOBS_TO_EMPLOYEES_RATIO
+            )
+        else:
+            self._create_employees()
+        if self.llm_engine:
+            # Replacement companies are scheduled after the employees
+            self._add_phase(partial(self._step_llm_companies, True), "llm_companies")
 
         self.agent_id_iter = self.num_employees + self.num_companies
 
         self.datacollector = StepStatsCollector(self)
 
-    def step(self):
-        self.datacollector.collect(self)
+    def __new__(cls, *args, seed=None, **kwargs):
+        # mesa seeds Model.random from a seed kwarg and cannot take a
+        # SeedSequence, it is reseeded from self.rng in __init__ instead
+        return super().__new__(cls, *args, **kwargs)
 
-        logger.debug(f"Model step {self.schedule.steps}")
+    def step(self):
+        with self.profile_span("data_collection"):
+            self.datacollector.collect(self)
+        if self.early_stop and (stop_reason := self.early_stop.check(self)):
+            logger.info("Stopping at step %s: %s", self.schedule.steps, stop_reason)
+            self.stop_reason = stop_reason
+            self.running = False
+            return
+
+        logger.debug("Model step %s", self.schedule.steps)
         if self.schedule.steps % 12 == 0:
-            logger.info("Adjusting market shares")
-            self._adjust_market_shares()
-            self.product_cost *= 1 + INFLATION_RATE
-            self._apply_company_yearly_raises()
+            with self.profile_span("market_adjustment"):
+                self._apply_yearly_changes()
+
+        with self.profile_span("schedule"):
+            self.schedule.step()
+
+        with self.profile_span("bankruptcy_check"):
+            self._replace_bankrupt_company()
 
-        self.schedule.step()
+        if self.check_totals:
+            for company in self.companies:
+                company._check_totals()
+
+        replaying = self.llm_cache is not None and self.llm_cache.replay
+        if self.llm_based and self.llm_engine is None and not replaying:
+            with self.profile_span("llm_rate_limit_sleep"):
+                sleep(1)
+
+    def apply_settings(self, settings: Settings) -> None:
+        # The settings read while stepping, which can also change mid-run,
+        # e.g. for variants forked from a checkpoint. CONSTRUCTION_SETTINGS
+        # only shape the initial economy.
+        self.company_operating_cost = settings.base_operating_cost
+        self.cost_per_hire = settings.cost_per_hire
+        self.initial_salary = settings.initial_salary
+        self.changing_jobs_raise = settings.changing_jobs_raise
+        self.quitting_multiplier = settings.quitting_multiplier
+        self.company_fire_probability = settings.company_fire_probability
+        self.company_emergency_months = settings.company_emergency_months
 
+    def reseed(self, seed: int | np.random.SeedSequence | None) -> None:
+        # Reseeds in place, the employee population shares self.rng
+        self.rng.bit_generator.state = np.random.default_rng(seed).bit_generator.state
+        self.uniforms = UniformDraws(self.rng)
+        self.reset_randomizer(int(self.rng.integers(2**63)))
+
+    def close(self) -> None:
+        # Closes the LLM engine's event loop once the model is finished, it
+        # cannot be stepped afterwards
+        if self.llm_engine:
+            self.llm_engine.close()
+
+    def __getstate__(self) -> dict:
+        # The LLM cache's connection cannot be pickled, load_checkpoint
+        # reattaches a cache together with the OpenAI client
+        state = self.__dict__.copy()
+        state["llm_cache"] = None
+        return state
+
+    def profile_span(self, name: str, category: str = "phase") -> AbstractContextManager:
+        if self.profiler is None:
+            return NOT_PROFILED
+        return self.profiler.span(name, category)
+
+    def _apply_yearly_changes(self) -> None:
+        logger.info("Adjusting market shares")
+        self._adjust_market_shares()
+        self.product_cost *= 1 + INFLATION_RATE
+        self._apply_company_yearly_raises()
+
+    def _replace_bankrupt_company(self) -> None:
         if bankrupt_company := next(
             (
                 company
                 for company in self.companies
-                if (company.funds < 2000 and len(company.employees) == 0) or (company.funds < 0)
+                if (company.funds < 2000 and company._employee_count() == 0) or (company.funds < 0)
             ),
             None,
         ):
-            logger.warning(f"Company #{bankrupt_company.unique_id} went bankrupt")
-            logger.warning(f"Company #{self.agent_id_iter} takes over the market share")
+            logger.warning("Company #%s went bankrupt", bankrupt_company.unique_id)
+            logger.warning("Company #%s takes over the market share", self.agent_id_iter)
             self.bankrupt_companies.append(bankrupt_company)
             self.companies.remove(bankrupt_company)
-            for bankrupt_employee in bankrupt_company.employees:
-                bankrupt_employee.change_work_state()
-            bankrupt_company.employees = []
+            del self.companies_by_id[bankrupt_company.unique_id]
+            self.hiring_pool.discard(bankrupt_company)
+            # Frees the grid cell for the company taking over the market share
+            if not self.headless and bankrupt_company.pos is not None:
+                self.grid.remove_agent(bankrupt_company)
+            bankrupt_company._lay_off_employees()
 
             company_available_products = int(
                 self.total_products * bankrupt_company.market_share
             )
             new_company_funds = company_available_products * self.product_cost * 3
-            if self.llm_based:
+            if self.vectorized:
+                new_company = CompanyPopulationAgent(
+                    self.agent_id_iter,
+                    self,
+                    bankrupt_company.market_share,
+                    company_available_products,
+                    new_company_funds,
+                )
+            elif self.llm_based:
                 new_company = CompanyLLMAgent(
                     self.agent_id_iter,
                     self,
@@ -191,20 +364,88 @@ class LaborModel(mesa.Model):
                     company_available_products,
                     new_company_funds,
                 )
-            self.companies.append(new_company)
-            self.schedule.add(new_company)
-            self._place_company(new_company)
+            self._add_company(new_company)
             self.agent_id_iter += 1
 
-        if self.llm_based:
-            sleep(1)
+    def _add_phase(self, callback: Callable[[], None], profile_name: str) -> None:
+        # Phases are numbered -1, -2, ... so mesa's schedulers keep them apart
+        self.phase_count += 1
+        self.schedule.add(ScheduledPhase(-self.phase_count, self, callback, profile_name))
+
+    def _add_company(self, company: CompanyAgent) -> None:
+        self.companies.append(company)
+        if isinstance(company, CompanyLLMAgent):
+            self.llm_companies.append(company)
+        self.companies_by_id[company.unique_id] = company
+        if company.accepting_applications:
+            self.hiring_pool.add(company)
+        self.schedule.add(company)
+        if not self.headless:
+            self._place_company(company)
+
+    def _create_employees(self) -> None:
+        # Companies step before employees, so quits are decided right before
+        # the first employee steps, after this month's hires
+        self._add_phase(self._decide_quits, "decide_quits")
+
+        employee_productivities = self._generate_employee_productivity_ratios()
+        current_companies_idx = 0
+        for i in range(self.num_companies, self.num_employees + self.num_companies):
+            employee_productivity = employee_productivities[i - self.num_companies]
+            e = EmployeeAgent(i, self, Seniority.JUNIOR, employee_productivity)
+            self.employees.append(e)
+            self.schedule.add(e)
+            if not self.headless:
+                self._place_agent(e)
+
+            if current_companies_idx < len(self.companies):
+                current_company = self.companies[current_companies_idx]
+                current_company_productivity = (
+                    current_company._calculate_total_productivity()
+                )
+                if (
+                    current_company_productivity
+                    < self.initial_employment_rate
+                    * current_company.available_sellable_products_count
+                    / JOBS_TO_EMPLOYEES_RATIO
+                ):
+                    e.change_work_state(current_company.unique_id, self.initial_salary)
+                    current_company._add_employee(e)
+                else:
+                    current_companies_idx += 1
+
+    def _step_llm_companies(self, replacements: bool) -> None:
+        # Runs where the sequential path would step these companies, so they
+        # see the same applications
+        companies = [
+            company
+            for company in self.llm_companies
+            if (company.unique_id >= self.num_companies) == replacements
+        ]
+        if companies:
+            self.llm_engine.step_companies(companies)
+
+    def _decide_quits(self) -> None:
+        working_employees = [e for e in self.employees if e.is_working]
+        times_in_state = np.fromiter(
+            (e.time_in_state for e in working_employees),
+            dtype=np.int64,
+            count=len(working_employees),
+        )
+        leave_probability = leave_probabilities(times_in_state) * self.quitting_multiplier
+        leaving = self.rng.random(len(working_employees)) < leave_probability
+        self.leaving_employees = {
+            working_employees[i] for i in np.flatnonzero(leaving)
+        }
 
     # [AVERAGE_PRODUCTIVITY - 1, AVERAGE_PRODUCTIVITY + 1]
-    def _generate_employee_productivity_ratio(self) -> float:
-        return AVERAGE_PRODUCTIVITY - 1 + random() * 2
+    def _generate_employee_productivity_ratios(self) -> list[float]:
+        return self.rng.uniform(
+            AVERAGE_PRODUCTIVITY - 1, AVERAGE_PRODUCTIVITY + 1, self.num_employees
+        ).tolist()
 
     def get_initial_market_shares(self) -> np.ndarray:
-        numbers = np.random.rand(self.num_companies)
+        numbers = self.rng.random(self.num_companies)
         normalized_numbers = numbers / np.sum(numbers)
 
         min_share_for_6_products = 6 / self.total_products
@@ -216,13 +457,14 @@ class LaborModel(mesa.Model):
 
     def _adjust_market_shares(self) -> None:
         # Mean (trend) for the stochastic shock
-        µ = random() / 10
+        µ = self.rng.random() / 10
         # Volatility factor for the stochastic shock
-        o = random() / 10
+        o = self.rng.random() / 10
 
-        for company in self.companies:
+        shocks = self.rng.normal(µ, o, len(self.companies))
+        for company, shock in zip(self.companies, shocks):
             company.market_share = max(
-                0, company.market_share * (1 + np.random.normal(µ, o))
+                0, company.market_share * (1 + shock)
             )
             company.available_sellable_products_count = int(
                 company.market_share * self.total_products
@@ -234,12 +476,18 @@ class LaborModel(mesa.Model):
             company.market_share /= total_market_share
 
     def _apply_company_yearly_raises(self) -> None:
+        if self.vectorized:
+            self.population.apply_yearly_raises(
+                [company for company in self.companies if company.funds > 5000]
+            )
+            return
         for company in self.companies:
             if company.funds > 5000:
-                for employee in company.employees:
-                    employee.current_salary *= 1 + INFLATION_RATE
+                company._apply_salary_raise(INFLATION_RATE)
 
     def _place_agent(self, a: mesa.Agent) -> None:
+        # Model.random (seeded from self.rng) so that placement does not shift
+        # the model's own draws and headless runs match rendered ones
         x = self.random.randrange(self.grid.width)
         y = self.random.randrange(self.grid.height)
         self.grid.place_agent(a, (x, y))
@@ -251,4 +499,13 @@ class LaborModel(mesa.Model):
             for x in X:
                 if self.grid.is_cell_empty((x, y)):
                     self.grid.place_agent(a, (x, y))
+                    # Companies never move, so their neighborhoods are computed once
+                    nearest = self.grid.get_neighborhood(
+                        (x, y), moore=True, include_center=False, radius=1
+                    )
+                    nearby = self.grid.get_neighborhood(
+                        (x, y), moore=True, include_center=False, radius=2
+                    )
+                    a.move_targets = [*nearest, *(p for p in nearby if p not in nearest)]
+                    a.nearby_cells = frozenset(nearby)
                     return
@@ -0,0 +1,101 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+import json
+from pathlib import Path
+from time import perf_counter
+from typing import Iterator
+
+import mesa
+
+
+@dataclass
+class TraceEvent:
+    name: str
+    category: str
+    # Seconds since the profiler was created
+    start: float
+    duration: float
+
+
+class Profiler:
+    # Wall time and call counts per model phase, agent type and LLM call.
+    # Every span is also kept as a TraceEvent, so a run can be inspected as a
+    # timeline in chrome://tracing or Perfetto.
+    origin: float
+    events: list[TraceEvent]
+    seconds: dict[str, float]
+    calls: dict[str, int]
+
+    def __init__(self):
+        self.origin = perf_counter()
+        self.events = []
+        self.seconds = {}
+        self.calls = {}
+
+    @contextmanager
+    def span(self, name: str, category: str = "phase") -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, perf_counter() - start)
+
+    def add(self, name: str, category: str, start: float, duration: float, calls: int = 1):
+        self.events.append(TraceEvent(name, category, start - self.origin, duration))
+        self.seconds[name] = self.seconds.get(name, 0) + duration
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        return {
+            name: {"seconds": self.seconds[name], "calls": self.calls[name]}
+            for name in sorted(self.seconds, key=self.seconds.get, reverse=True)
+        }
+
+    def save_chrome_trace(self, path: Path):
+        trace_events = [
+            {
+                "name": event.name,
+                "cat": event.category,
+                "ph": "X",
+                "ts": event.start * 1e6,
+                "dur": event.duration * 1e6,
+                "pid": 0,
+                "tid": 0,
+            }
+            for event in self.events
+        ]
+        Path(path).write_text(json.dumps({"traceEvents": trace_events}))
+
+
+class ProfiledActivation(mesa.time.SimultaneousActivation):
+    # SimultaneousActivation that times agent steps by agent type, or by
+    # profile_name for agents that have one. Agents step in insertion order,
+    # so consecutive agents of one type are recorded as a single span instead
+    # of one event per agent.
+    profiler: Profiler
+
+    def __init__(self, model: mesa.Model, profiler: Profiler):
+        super().__init__(model)
+        self.profiler = profiler
+
+    def do_each(self, method, *args, **kwargs):
+        # SimultaneousActivation.step calls do_each(method) on every mesa
+        # version, the other arguments differ between them
+        if method != "step" or args or kwargs:
+            super().do_each(method, *args, **kwargs)
+            return
+
+        run_type, run_start, run_seconds, run_calls = None, 0.0, 0.0, 0
+        # A copy, so agents added while stepping wait for the next step
+        for agent in list(self.agents):
+            agent_type = getattr(agent, "profile_name", None) or type(agent).__name__
+            if agent_type != run_type:
+                if run_type is not None:
+                    self.profiler.add(run_type, "agent", run_start, run_seconds, run_calls)
+                run_type, run_start, run_seconds, run_calls = agent_type, perf_counter(), 0.0, 0
+            start = perf_counter()
+            agent.step()
+            run_seconds += perf_counter() - start
+            run_calls += 1
+        if run_type is not None:
+            self.profiler.add(run_type, "agent", run_start, run_seconds, run_calls)
@@ -0,0 +1,208 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from labor_model.config import Settings
+from labor_model.early_stop import DIVERGED, MAX_STEPS
+
+RUNS_FILE = "runs.jsonl"
+SETTINGS_FILE = "settings.json"
+
+# Every StepStatsCollector reporter is stored as float64 unless listed here
+INTEGER_COLUMNS = {"Original Companies Left"}
+
+
+def _column_file(name: str) -> str:
+    return name.lower().replace(" ", "_") + ".bin"
+
+
+class StoredRunGroup:
+    # Runs of one parameter combination, addressed by their final step rows.
+    # Runs that were stopped early have fewer rows than the others, diverged
+    # ones are left out of the averages of the final rows.
+    store: "ResultsStore"
+    num_companies: int
+    num_employees: int
+    settings: Settings
+    final_rows: np.ndarray
+    row_counts: np.ndarray
+    stop_reasons: list[str]
+    kept_rows: np.ndarray
+
+    def __init__(
+        self,
+        store: "ResultsStore",
+        num_companies: int,
+        num_employees: int,
+        settings: Settings,
+        final_rows: np.ndarray,
+        row_counts: np.ndarray,
+        stop_reasons: list[str],
+    ):
+        self.store = store
+        self.num_companies = num_companies
+        self.num_employees = num_employees
+        self.settings = settings
+        self.final_rows = final_rows
+        self.row_counts = row_counts
+        self.stop_reasons = stop_reasons
+        self.kept_rows = final_rows[[reason not in DIVERGED for reason in stop_reasons]]
+
+    def __len__(self) -> int:
+        return len(self.final_rows)
+
+    @property
+    def stopped_early(self) -> int:
+        return sum(reason != MAX_STEPS for reason in self.stop_reasons)
+
+    @property
+    def diverged(self) -> int:
+        return len(self.final_rows) - len(self.kept_rows)
+
+    def average(self, column: str) -> float:
+        # nan once every run diverged
+        if len(self.kept_rows) == 0:
+            return float("nan")
+        return float(self.store.column(column)[self.kept_rows].mean())
+
+    def average_steps(self) -> float:
+        return float(self.row_counts.mean()) - 1
+
+    def step_averages(self, column: str) -> np.ndarray:
+        # The average of every step over the runs that got that far
+        first_rows = self.final_rows - self.row_counts + 1
+        rows = np.concatenate(
+            [np.arange(first, first + count) for first, count in zip(first_rows, self.row_counts)]
+        )
+        steps = self.store.column("Step")[rows]
+        return np.bincount(steps, weights=self.store.column(column)[rows]) / np.bincount(steps)
+
+
+class ResultsStore:
+    # Batch results on disk: one row per (run, step) with a file per column,
+    # plus runs.jsonl as the run dimension table. Columns are appended before
+    # their run is recorded in runs.jsonl, so rows of a run that was cut off
+    # by a crash are dropped when the store is opened again.
+    path: Path
+    runs: dict[int, dict]
+    column_names: list[str]
+    row_count: int
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.runs = {}
+        self.column_names = []
+        self.row_count = 0
+        self._load()
+
+    def _load(self):
+        runs_path = self.path / RUNS_FILE
+        if runs_path.exists():
+            with runs_path.open() as runs_file:
+                for line in runs_file:
+                    try:
+                        run = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    # Runs stored before batches could warm up
+                    run.setdefault("warmup_steps", 0)
+                    # and before they could be stopped early
+                    run.setdefault("steps", run["row_count"] - 1)
+                    run.setdefault("stop_reason", MAX_STEPS)
+                    self.runs[run["RunId"]] = run
+                    self.column_names = run["columns"]
+                    self.row_count = max(self.row_count, run["first_row"] + run["row_count"])
+
+        if not self.runs:
+            for column_path in self.path.glob("*.bin"):
+                column_path.unlink()
+        for name, dtype in self._dtypes().items():
+            column_path = self.path / _column_file(name)
+            if column_path.exists():
+                with column_path.open("r+b") as column_file:
+                    column_file.truncate(self.row_count * np.dtype(dtype).itemsize)
+
+    def _dtypes(self) -> dict[str, type]:
+        dtypes = {"RunId": np.int64, "Step": np.int64}
+        for name in self.column_names:
+            dtypes[name] = np.int64 if name in INTEGER_COLUMNS else np.float64
+        return dtypes
+
+    def save_settings(self, settings: Settings):
+        values = settings.model_dump(exclude={"open_ai_key"})
+        (self.path / SETTINGS_FILE).write_text(json.dumps(values))
+
+    def load_settings(self, setting_overrides: dict) -> Settings:
+        values = json.loads((self.path / SETTINGS_FILE).read_text())
+        return Settings.model_construct(**{**values, **setting_overrides})
+
+    def append_run(self, run: dict, history: dict[str, list]):
+        if not self.column_names:
+            self.column_names = list(history)
+        row_count = len(next(iter(history.values())))
+        columns = {
+            "RunId": [run["RunId"]] * row_count,
+            "Step": range(row_count),
+            **history,
+        }
+
+        first_row = self.row_count
+        for name, dtype in self._dtypes().items():
+            with (self.path / _column_file(name)).open("ab") as column_file:
+                column_file.write(np.asarray(columns[name], dtype=dtype).tobytes())
+
+        run = {
+            **run,
+            "first_row": first_row,
+            "row_count": row_count,
+            "columns": self.column_names,
+        }
+        with (self.path / RUNS_FILE).open("a") as runs_file:
+            runs_file.write(json.dumps(run, default=float) + "\n")
+        self.runs[run["RunId"]] = run
+        self.row_count += row_count
+
+    def column(self, name: str) -> np.ndarray:
+        dtype = self._dtypes()[name]
+        column_path = self.path / _column_file(name)
+        if not column_path.exists() or column_path.stat().st_size == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(column_path, dtype=dtype, mode="r")
+
+    def columns(self) -> dict[str, np.ndarray]:
+        return {name: self.column(name) for name in self._dtypes()}
+
+    def final_row(self, run_id: int) -> dict:
+        run = self.runs[run_id]
+        row = run["first_row"] + run["row_count"] - 1
+        return {name: self.column(name)[row].item() for name in self.column_names}
+
+    def group_runs(self) -> list[StoredRunGroup]:
+        grouped_runs = {}
+        for run in self.runs.values():
+            grouped_runs.setdefault(run["fingerprint"], []).append(run)
+
+        groups = []
+        for runs in grouped_runs.values():
+            num_companies, num_employees = runs[0]["num_companies"], runs[0]["num_employees"]
+            final_rows = np.fromiter(
+                (run["first_row"] + run["row_count"] - 1 for run in runs),
+                dtype=np.int64,
+                count=len(runs),
+            )
+            row_counts = np.fromiter((run["row_count"] for run in runs), dtype=np.int64, count=len(runs))
+            settings = self.load_settings(runs[0]["setting_overrides"])
+            groups.append(
+                StoredRunGroup(
+                    self,
+                    num_companies,
+                    num_employees,
+                    settings,
+                    final_rows,
+                    row_counts,
+                    [run["stop_reason"] for run in runs],
+                )
+            )
+        return groups
@@ -0,0 +1,26 @@
+from typing import Callable
+
+import mesa
+
+
+class ScheduledPhase(mesa.Agent):
+    # Runs a model level callback at a fixed place in the activation order.
+    # It is not a market participant, hence the negative id, which the model
+    # makes unique among its phases.
+    callback: Callable[[], None]
+    # Reported by ProfiledActivation instead of the agent type
+    profile_name: str
+
+    def __init__(
+        self,
+        unique_id: int,
+        model: mesa.Model,
+        callback: Callable[[], None],
+        profile_name: str = "ScheduledPhase",
+    ):
+        super().__init__(unique_id, model)
+        self.callback = callback
+        self.profile_name = profile_name
+
+    def step(self):
+        self.callback()
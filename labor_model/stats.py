@@ -1,8 +1,9 @@
 from dataclasses import dataclass
 
-from labor_model.employee_agent import EmployeeAgent, WorkRecord
 from labor_model.company_agent import CompanyAgent
 from labor_model.model import LaborModel
+from labor_model.work_history import (WorkHistory, calculate_time_between_jobs,
+                                      calculate_work_lengths)
 
 
 @dataclass
@@ -95,34 +96,11 @@ class StepStatsCalculator:
     def get_companies_product_fill_rate(self) -> float:
         return sum([c._calculate_total_productivity() / c.available_sellable_products_count for c in self.model.companies]) / len(self.model.companies)
 
-def calculate_work_lengths(all_ended_work_records: list[WorkRecord]) -> list[int]:
-    return [r.to_time - r.from_time for r in all_ended_work_records]
-
-
-def calculate_time_between_jobs(
-    all_employee_work_records: list[list[WorkRecord]],
-) -> list[int]:
-    times_between_jobs = []
-    for work_records in all_employee_work_records:
-        for i in range(len(work_records) - 1):
-            times_between_jobs.append(
-                work_records[i + 1].from_time - work_records[i].to_time
-            )
-    return times_between_jobs
-
-
-def print_employee_stats(employees: list[EmployeeAgent]) -> None:
-    all_employee_work_records = [e.work_records for e in employees]
-    all_ended_work_records = [
-        r
-        for records in all_employee_work_records
-        for r in records
-        if r.to_time is not None
-    ]
-    work_lengths = calculate_work_lengths(all_ended_work_records)
-    time_between_jobs = calculate_time_between_jobs(all_employee_work_records)
-    print(f"Average work tenure: {sum(work_lengths) / len(work_lengths):.2f}")
-    print(f"Average time between jobs: {sum(time_between_jobs) / len(work_lengths):.2f}")
+def print_employee_stats(work_history: WorkHistory) -> None:
+    work_lengths = calculate_work_lengths(work_history)
+    time_between_jobs = calculate_time_between_jobs(work_history)
+    print(f"Average work tenure: {work_lengths.sum() / len(work_lengths):.2f}")
+    print(f"Average time between jobs: {time_between_jobs.sum() / len(work_lengths):.2f}")
 
 def print_unemployment_stats(unemployment_rates: list[float]) -> None:
     unemployment_average = sum(unemployment_rates) / len(unemployment_rates)
@@ -1,4 +1,4 @@
-from random import random
+import numpy as np
 
 AVERAGE_PRODUCTIVITY = 5
 
@@ -7,5 +7,23 @@ INFLATION_RATE = 0.03
 JOBS_TO_EMPLOYEES_RATIO = 1.06
 
 
-def decide_based_on_probability(probability: int) -> bool:
-    return random() < probability
+class UniformDraws:
+    # Uniform [0, 1) numbers for decisions made one agent at a time, drawn
+    # from the model's generator in blocks instead of one call per decision
+    rng: np.random.Generator
+    block: list[float]
+    position: int
+
+    def __init__(self, rng: np.random.Generator, block_size: int = 4096):
+        self.rng = rng
+        self.block_size = block_size
+        self.block = []
+        self.position = 0
+
+    def next(self) -> float:
+        if self.position == len(self.block):
+            self.block = self.rng.random(self.block_size).tolist()
+            self.position = 0
+        value = self.block[self.position]
+        self.position += 1
+        return value
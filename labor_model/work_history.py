@@ -0,0 +1,92 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+# to_time of a record whose job has not ended yet
+OPEN = -1
+
+
+@dataclass
+class WorkRecord:
+    employer_id: int
+    salary: int
+    from_time: int
+    to_time: int | None
+
+
+class WorkHistory:
+    # Every employee's work records as growable typed arrays, one row per
+    # record, appended in hiring order. Employees only keep the row index of
+    # their latest record.
+    size: int
+
+    employee_id: np.ndarray
+    employer_id: np.ndarray
+    salary: np.ndarray
+    from_time: np.ndarray
+    to_time: np.ndarray
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.employee_id = np.zeros(capacity, dtype=np.int64)
+        self.employer_id = np.zeros(capacity, dtype=np.int64)
+        self.salary = np.zeros(capacity)
+        self.from_time = np.zeros(capacity, dtype=np.int64)
+        self.to_time = np.full(capacity, OPEN, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _grow(self):
+        capacity = 2 * len(self.employee_id)
+        for name in ("employee_id", "employer_id", "salary", "from_time", "to_time"):
+            old = getattr(self, name)
+            new = np.full(capacity, OPEN, dtype=old.dtype)
+            new[: len(old)] = old
+            setattr(self, name, new)
+
+    def open(self, employee_id: int, employer_id: int, salary: float, from_time: int) -> int:
+        if self.size == len(self.employee_id):
+            self._grow()
+        index = self.size
+        self.employee_id[index] = employee_id
+        self.employer_id[index] = employer_id
+        self.salary[index] = salary
+        self.from_time[index] = from_time
+        self.size += 1
+        return index
+
+    def close(self, index: int, to_time: int, salary: float):
+        self.to_time[index] = to_time
+        self.salary[index] = salary
+
+    def record(self, index: int) -> WorkRecord:
+        to_time = int(self.to_time[index])
+        return WorkRecord(
+            int(self.employer_id[index]),
+            float(self.salary[index]),
+            int(self.from_time[index]),
+            None if to_time == OPEN else to_time,
+        )
+
+    def records_of(self, employee_id: int) -> list[WorkRecord]:
+        indices = np.flatnonzero(self.employee_id[: self.size] == employee_id)
+        return [self.record(index) for index in indices]
+
+
+def calculate_work_lengths(work_history: WorkHistory) -> np.ndarray:
+    to_time = work_history.to_time[: work_history.size]
+    ended = to_time != OPEN
+    return to_time[ended] - work_history.from_time[: work_history.size][ended]
+
+
+def calculate_time_between_jobs(work_history: WorkHistory) -> np.ndarray:
+    # Records are appended in time order, so a stable sort by employee keeps
+    # each employee's records chronological
+    size = work_history.size
+    order = np.argsort(work_history.employee_id[:size], kind="stable")
+    employee_id = work_history.employee_id[:size][order]
+    from_time = work_history.from_time[:size][order]
+    to_time = work_history.to_time[:size][order]
+    same_employee = employee_id[1:] == employee_id[:-1]
+    return from_time[1:][same_employee] - to_time[:-1][same_employee]
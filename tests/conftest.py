@@ -0,0 +1,20 @@
+import logging
+
+import pytest
+
+from labor_model.config import Settings
+from labor_model.local_logging import logger
+
+
+@pytest.fixture(autouse=True)
+def quiet_logger():
+    # The stub LLM's malformed answers are logged as errors by design
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    yield
+    logger.setLevel(level)
+
+
+@pytest.fixture
+def settings() -> Settings:
+    return Settings(open_ai_key="")
@@ -0,0 +1,64 @@
+from labor_model.batch import (add_to_groups, calculate_group_statistics,
+                               group_elements, run_batch, run_fingerprint)
+from labor_model.config import Settings
+from labor_model.results_store import ResultsStore
+
+
+def variations(settings: Settings) -> list[Settings]:
+    return [settings.model_copy(update={"quitting_multiplier": multiplier}) for multiplier in (0.2, 0.4)]
+
+
+def final_rows(summaries: list[dict]) -> list[tuple]:
+    return sorted((summary["RunId"], summary["Unemployment Rate"], summary["Average Work Tenure"]) for summary in summaries)
+
+
+def test_seeded_batches_do_not_depend_on_the_process_count(settings):
+    options = dict(seed=1, display_progress=False)
+    single = list(run_batch(settings, variations(settings), 95, 9, 2, 30, number_processes=1, **options))
+    pooled = list(run_batch(settings, variations(settings), 95, 9, 2, 30, number_processes=2, chunk_size=2, **options))
+
+    assert final_rows(single) == final_rows(pooled)
+    assert all("history" not in summary for summary in single)
+
+
+def test_store_resumes_a_batch(settings, tmp_path):
+    options = dict(number_processes=1, seed=1, display_progress=False)
+    summaries = list(run_batch(settings, variations(settings), 95, 9, 2, 30, store=ResultsStore(tmp_path), **options))
+    store = ResultsStore(tmp_path)
+    resumed = list(run_batch(settings, variations(settings), 95, 9, 2, 30, store=store, **options))
+
+    assert final_rows(resumed) == final_rows(summaries)
+    assert store.row_count == 4 * 31
+    assert [store.final_row(summary["RunId"])["Unemployment Rate"] for summary in summaries] == [
+        summary["Unemployment Rate"] for summary in summaries
+    ]
+
+
+def test_fingerprints_ignore_the_api_key(settings):
+    other_key = settings.model_copy(update={"open_ai_key": "other"})
+
+    assert run_fingerprint(9, 95, other_key) == run_fingerprint(9, 95, settings)
+    assert run_fingerprint(9, 95, variations(settings)[0]) != run_fingerprint(9, 95, settings)
+    assert run_fingerprint(9, 96, settings) != run_fingerprint(9, 95, settings)
+
+
+def test_stored_and_listed_runs_group_like_memory(settings, tmp_path):
+    options = dict(number_processes=1, seed=1, display_progress=False, store=ResultsStore(tmp_path))
+    summaries = list(run_batch(settings, variations(settings), 95, 9, 2, 30, **options))
+
+    groups = {}
+    for summary in summaries:
+        add_to_groups(groups, summary)
+    in_memory = calculate_group_statistics(list(groups.values()))
+    assert len(in_memory) == 2
+    assert calculate_group_statistics(group_elements(ResultsStore(tmp_path))) == in_memory
+    assert calculate_group_statistics(group_elements(summaries)) == in_memory
+
+
+def test_forked_variants_match_checkpointed_variants(settings):
+    options = dict(number_processes=1, seed=1, display_progress=False, warmup_steps=10)
+    checkpointed = list(run_batch(settings, variations(settings), 95, 9, 2, 30, **options))
+    forked = list(run_batch(settings, variations(settings), 95, 9, 2, 30, copy_on_write=True, **options))
+
+    assert final_rows(forked) == final_rows(checkpointed)
+    assert all(summary["warmup_steps"] == 10 for summary in forked)
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from labor_model.bench import PHASES, BenchCase, LLMBenchOptions, run_case
+
+
+def test_unprofiled_cases_only_report_totals():
+    result = run_case(BenchCase(95, 9, "vectorized", 10, 1))
+
+    assert (result.num_employees, result.num_companies, result.engine, result.steps, result.headless) == (
+        95,
+        9,
+        "vectorized",
+        10,
+        True,
+    )
+    assert result.step_seconds > 0
+    assert result.phase_seconds == {}
+    assert result.peak_memory_mb >= result.baseline_memory_mb
+    assert result.llm_requests == 0
+
+
+def test_profiled_cases_split_the_steps_into_phases(tmp_path):
+    trace_path = tmp_path / "trace.json"
+    result = run_case(BenchCase(95, 9, "agents", 10, 1, trace_path, profile=True, headless=False))
+
+    assert list(result.phase_seconds) == [*PHASES, "other"]
+    assert result.phase_seconds["employee_phase"] > 0
+    assert result.phase_seconds["company_phase"] > 0
+    assert sum(result.phase_seconds.values()) == pytest.approx(result.step_seconds, rel=0.05)
+    assert json.loads(trace_path.read_text())["traceEvents"]
+
+
+def test_llm_cases_count_stub_requests():
+    llm = LLMBenchOptions(latency=0.01, concurrency=3, requests_per_second=10_000)
+    result = run_case(BenchCase(95, 9, "llm", 5, 1, llm=llm))
+
+    assert result.llm_requests > 0
+    assert result.llm_max_in_flight <= 3
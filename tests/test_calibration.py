@@ -0,0 +1,43 @@
+from labor_model import calibration
+from labor_model.batch import RunGroup, add_to_groups, run_batch, run_fingerprint
+from labor_model.calibration import _result, successive_halving
+
+
+def test_successive_halving_keeps_the_best_candidates(settings, monkeypatch):
+    rounds = []
+
+    def recorded_run_batch(*args, **options):
+        summaries = list(run_batch(*args, **options))
+        rounds.append(summaries)
+        return summaries
+
+    monkeypatch.setattr(calibration, "run_batch", recorded_run_batch)
+    candidates = [settings.model_copy(update={"quitting_multiplier": multiplier}) for multiplier in (0.1, 0.2, 0.4, 0.8)]
+    results = successive_halving(
+        settings,
+        candidates,
+        95,
+        9,
+        12,
+        min_iterations=1,
+        max_iterations=3,
+        eta=3,
+        seed=1,
+        number_processes=1,
+        display_progress=False,
+    )
+
+    # Four candidates run once, then the best ceil(4 / 3) until they have three runs each
+    assert [len(summaries) for summaries in rounds] == [4, 4]
+    assert [result.iterations for result in results] == [3, 3, 1, 1]
+    assert results[0].error <= results[1].error
+
+    first_round: dict[str, RunGroup] = {}
+    for summary in rounds[0]:
+        add_to_groups(first_round, summary)
+    errors = {fingerprint: _result(group).error for fingerprint, group in first_round.items()}
+    survivors = {run_fingerprint(9, 95, result.settings) for result in results[:2]}
+    assert max(errors[fingerprint] for fingerprint in survivors) <= min(
+        error for fingerprint, error in errors.items() if fingerprint not in survivors
+    )
+    assert {summary["fingerprint"] for summary in rounds[1]} == survivors
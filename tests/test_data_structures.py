@@ -0,0 +1,112 @@
+from dataclasses import dataclass
+import random
+
+import pytest
+
+from labor_model.efficiency_heap import EfficiencyHeap
+from labor_model.employee_agent import ApplicationBuffer
+from labor_model.hiring_pool import HiringPool
+from labor_model.work_history import (OPEN, WorkHistory, WorkRecord,
+                                      calculate_time_between_jobs,
+                                      calculate_work_lengths)
+
+
+@dataclass(eq=False)
+class Employee:
+    current_salary: float
+    productivity: float
+
+
+def test_hiring_pool_keeps_positions_consistent():
+    rng = random.Random(0)
+    pool = HiringPool()
+    expected = set()
+    companies = [object() for _ in range(50)]
+    for _ in range(2000):
+        company = rng.choice(companies)
+        if rng.random() < 0.5:
+            pool.add(company)
+            expected.add(company)
+        else:
+            pool.discard(company)
+            expected.discard(company)
+
+        assert len(pool) == len(expected)
+        assert set(pool) == expected
+        assert all(pool.companies[position] is company for company, position in pool.positions.items())
+
+
+def test_hiring_pool_choice_covers_every_company():
+    pool = HiringPool()
+    companies = [object() for _ in range(4)]
+    for company in companies:
+        pool.add(company)
+    pool.add(companies[0])
+
+    assert len(pool) == 4
+    assert [pool.choice(uniform) for uniform in (0.0, 0.25, 0.5, 0.999)] == companies
+
+
+def test_efficiency_heap_matches_scanning_the_roster():
+    rng = random.Random(1)
+    heap = EfficiencyHeap()
+    roster = []
+    for _ in range(1000):
+        if roster and rng.random() < 0.4:
+            employee = roster.pop(rng.randrange(len(roster)))
+            heap.remove(employee)
+        else:
+            employee = Employee(rng.choice([1000, 2000, 3000]), rng.choice([0.5, 1.0, 2.0]))
+            roster.append(employee)
+            heap.push(employee)
+        if rng.random() < 0.05:
+            for employee in roster:
+                employee.current_salary *= 1.03
+            heap.rebuild()
+
+        assert len(heap) == len(roster)
+        if roster:
+            # max() returns the first of equally inefficient employees, the
+            # one hired first
+            expected = max(roster, key=lambda employee: employee.current_salary / employee.productivity)
+            assert heap.least_efficient() is expected
+
+
+def test_work_history_grows_past_its_capacity():
+    history = WorkHistory(capacity=2)
+    first = history.open(1, 7, 1000.0, 0)
+    history.close(first, 10, 1100.0)
+    second = history.open(1, 8, 1200.0, 13)
+    for employee_id in range(2, 6):
+        history.open(employee_id, 7, 1000.0, employee_id)
+
+    assert len(history) == 6
+    assert history.records_of(1) == [WorkRecord(7, 1100.0, 0, 10), WorkRecord(8, 1200.0, 13, None)]
+    assert history.to_time[second] == OPEN
+    assert calculate_work_lengths(history).tolist() == [10]
+    assert calculate_time_between_jobs(history).tolist() == [3]
+
+
+def test_application_buffer_reuses_applications():
+    buffer = ApplicationBuffer()
+    for salary in range(3):
+        buffer.append(f"employee {salary}", salary)
+    first = buffer[0]
+    buffer.clear()
+    buffer.append("employee", 10)
+
+    assert len(buffer) == 1
+    assert buffer[0] is first
+    assert buffer[-1].desired_salary == 10
+    assert [application.employee for application in buffer] == ["employee"]
+    with pytest.raises(IndexError):
+        buffer[1]
+
+
+def test_application_buffer_remove_keeps_order():
+    buffer = ApplicationBuffer()
+    for salary in range(4):
+        buffer.append(f"employee {salary}", salary)
+    buffer.remove(buffer[1])
+
+    assert [application.desired_salary for application in buffer] == [0, 2, 3]
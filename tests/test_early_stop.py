@@ -0,0 +1,163 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+from labor_model.batch import (add_to_groups, calculate_error,
+                               calculate_group_statistics, group_elements,
+                               run_batch, run_fingerprint)
+from labor_model.config import Settings
+from labor_model.early_stop import (ALL_ORIGINAL_COMPANIES_BANKRUPT,
+                                    BANKRUPTCY_CASCADE, CONVERGED,
+                                    FULL_EMPLOYMENT_LOSSES, MAX_STEPS,
+                                    UNEMPLOYMENT_PINNED, EarlyStop)
+from labor_model.model import LaborModel
+from labor_model.results_store import ResultsStore
+
+STEPS = 48
+
+
+def model_with_history(**overrides) -> SimpleNamespace:
+    # A steady, healthy economy unless overridden
+    history = {
+        "Unemployment Rate": [0.05 + 0.001 * (step % 3) for step in range(STEPS)],
+        "Average Work Tenure": [20.0] * STEPS,
+        "Average Time Between Jobs": [2.0] * STEPS,
+        "Average Quit Rate": [0.6] * STEPS,
+        "Company Profit Average": [0.1 * step for step in range(STEPS)],
+        "Original Companies Left": [9] * STEPS,
+        **overrides,
+    }
+    return SimpleNamespace(datacollector=SimpleNamespace(model_vars=history), num_companies=9)
+
+
+def test_steady_statistics_converge():
+    assert EarlyStop().check(model_with_history()) == CONVERGED
+    assert EarlyStop(convergence_window=None).check(model_with_history()) is None
+
+
+def test_drifting_statistics_do_not_converge():
+    drifting = model_with_history(**{"Average Work Tenure": [10 + 0.5 * step for step in range(STEPS)]})
+
+    assert EarlyStop().check(drifting) is None
+
+
+def test_no_run_stops_before_min_steps():
+    model = model_with_history(**{"Original Companies Left": [9] * (STEPS - 1) + [0]})
+
+    assert EarlyStop(min_steps=STEPS + 1).check(model) is None
+    assert EarlyStop().check(model) == ALL_ORIGINAL_COMPANIES_BANKRUPT
+
+
+def test_bankruptcy_cascade():
+    cascade = model_with_history(**{"Original Companies Left": [9] * 40 + [4] * 8})
+    slow_decline = model_with_history(**{"Original Companies Left": [9 - step // 12 for step in range(STEPS)]})
+
+    assert EarlyStop().check(cascade) == BANKRUPTCY_CASCADE
+    assert EarlyStop(convergence_window=None).check(slow_decline) is None
+
+
+def test_everyone_unemployed():
+    model = model_with_history(**{"Unemployment Rate": [0.3] * 30 + [1.0] * 18})
+
+    assert EarlyStop().check(model) == UNEMPLOYMENT_PINNED
+
+
+def test_full_employment_only_stops_while_profits_fall():
+    employed = {"Unemployment Rate": [0.0] * STEPS}
+    rising = model_with_history(**employed)
+    falling = model_with_history(**employed, **{"Company Profit Average": [3 - 0.1 * step for step in range(STEPS)]})
+
+    assert EarlyStop(convergence_window=None).check(rising) is None
+    assert EarlyStop().check(falling) == FULL_EMPLOYMENT_LOSSES
+
+
+def test_default_settings_rarely_stop_early():
+    # Healthy runs keep everyone employed for a year or more, which must not
+    # be taken for divergence
+    early_stop = EarlyStop()
+    stop_reasons = []
+    for seed in range(40):
+        model = LaborModel(95, 9, Settings(open_ai_key=""), headless=True, seed=seed, early_stop=early_stop)
+        for _ in range(120):
+            model.step()
+            if not model.running:
+                break
+        stop_reasons.append(model.stop_reason)
+
+    assert sum(reason is not None for reason in stop_reasons) <= 4
+
+
+def test_stopped_runs_are_recorded_with_their_length(tmp_path):
+    settings = Settings(open_ai_key="")
+    # Converges once two windows of 6 steps agree within 50%
+    early_stop = EarlyStop(min_steps=12, convergence_window=6, convergence_tolerance=0.5, convergence_max_cv=0.5)
+    options = dict(number_processes=1, seed=1, display_progress=False, early_stop=early_stop)
+    summaries = list(run_batch(settings, [settings], 95, 9, 4, 60, store=ResultsStore(tmp_path), **options))
+    stopped = [summary for summary in summaries if summary["stop_reason"] != MAX_STEPS]
+
+    assert stopped
+    assert all(summary["steps"] < 60 for summary in stopped)
+    assert all(summary["steps"] == 60 for summary in summaries if summary not in stopped)
+
+    store = ResultsStore(tmp_path)
+    assert sorted(run["row_count"] for run in store.runs.values()) == sorted(summary["steps"] + 1 for summary in summaries)
+    resumed = list(run_batch(settings, [settings], 95, 9, 4, 60, store=store, **options))
+    assert sorted((summary["RunId"], summary["steps"], summary["stop_reason"]) for summary in resumed) == sorted(
+        (summary["RunId"], summary["steps"], summary["stop_reason"]) for summary in summaries
+    )
+
+    groups = {}
+    for summary in summaries:
+        add_to_groups(groups, summary)
+    statistics = calculate_group_statistics(list(groups.values()))[0]
+    assert statistics["stopped_early"] == len(stopped)
+    assert statistics["average_steps"] == round(sum(summary["steps"] for summary in summaries) / 4, 2)
+    assert calculate_group_statistics(group_elements(store)) == [statistics]
+
+    step_averages = group_elements(store)[0].step_averages("Unemployment Rate")
+    assert len(step_averages) == max(summary["steps"] for summary in summaries) + 1
+
+
+def test_diverged_runs_are_left_out_of_the_averages(tmp_path):
+    settings = Settings(open_ai_key="")
+    fingerprint = run_fingerprint(9, 95, settings)
+    store = ResultsStore(tmp_path)
+    store.save_settings(settings)
+    summaries = []
+    for run_id, (stop_reason, unemployment) in enumerate(
+        [(MAX_STEPS, 0.04), (CONVERGED, 0.06), (BANKRUPTCY_CASCADE, 0.9)]
+    ):
+        history = {
+            "Unemployment Rate": [unemployment] * 3,
+            "Company Profit Average": [1.0] * 3,
+            "Average Work Tenure": [29.0] * 3,
+            "Average Time Between Jobs": [2.0] * 3,
+            "Average Quit Rate": [0.6] * 3,
+            "Original Companies Left": [9] * 3,
+            "Original Company Profits": [1.0] * 3,
+        }
+        run = dict(
+            RunId=run_id,
+            num_companies=9,
+            num_employees=95,
+            setting_overrides={},
+            fingerprint=fingerprint,
+            steps=2,
+            stop_reason=stop_reason,
+        )
+        store.append_run(run, history)
+        summaries.append({**run, "settings": settings, **{name: values[-1] for name, values in history.items()}})
+
+    groups = {}
+    for summary in summaries:
+        add_to_groups(groups, summary)
+    statistics = calculate_group_statistics(list(groups.values()))[0]
+    assert statistics["average_unemployment_rate"] == 0.05
+    assert (statistics["runs"], statistics["stopped_early"], statistics["diverged"]) == (3, 2, 1)
+    assert calculate_group_statistics([summaries]) == [statistics]
+    assert calculate_group_statistics(group_elements(store)) == [statistics]
+
+    # Penalized instead, and a candidate whose runs all diverged ranks last
+    assert calculate_error(statistics) > calculate_error({**statistics, "diverged": 0})
+    assert calculate_error(calculate_group_statistics([summaries[2:]])[0]) == math.inf
@@ -0,0 +1,40 @@
+from statistics import fmean
+
+import numpy as np
+import pytest
+
+from labor_model.model import LaborModel
+
+TRACKED = ["Unemployment Rate", "Average Work Tenure", "Average Time Between Jobs", "Average Quit Rate"]
+
+
+def run(model: LaborModel, steps: int) -> dict[str, list]:
+    for _ in range(steps):
+        model.step()
+    return model.datacollector.model_vars
+
+
+def test_vectorized_engine_matches_agent_statistics(settings):
+    # The engines draw their random numbers differently, so only averages
+    # over several seeds are comparable
+    averages = {}
+    for vectorized in (False, True):
+        runs = [run(LaborModel(500, 10, settings, seed=seed, vectorized=vectorized), 60) for seed in range(10)]
+        averages[vectorized] = {name: fmean(fmean(history[name]) for history in runs) for name in TRACKED}
+
+    assert averages[True]["Unemployment Rate"] == pytest.approx(averages[False]["Unemployment Rate"], abs=0.01)
+    for name in TRACKED[1:]:
+        assert averages[True][name] == pytest.approx(averages[False][name], rel=0.1)
+
+
+def test_member_index_follows_the_employer_array(settings):
+    settings.company_fire_probability = 0.5
+    model = LaborModel(2000, 20, settings, seed=4, vectorized=True, headless=True)
+    run(model, 2)
+    population = model.population
+    for company in population.companies:
+        population.members_of(company)
+
+    run(model, 40)
+    for slot, members in population.members.items():
+        assert sorted(members) == np.flatnonzero(population.employer == slot).tolist()
@@ -0,0 +1,153 @@
+import pytest
+
+from labor_model.checkpoint import load_checkpoint, save_checkpoint
+from labor_model.company_llm_agent import CompanyLLMAgent
+from labor_model.config import Settings
+from labor_model.llm_backends import AsyncStubLLMClient, StubLLMClient, StubResponder
+from labor_model.llm_cache import PromptCache, ReplayMiss
+from labor_model.llm_deciding import Decision, parse_employee_counts
+from labor_model.model import LaborModel
+
+
+def llm_model(client, seed: int = 3, **options) -> LaborModel:
+    return LaborModel(
+        95,
+        9,
+        Settings(open_ai_key=""),
+        llm_based=True,
+        open_ai_client=client,
+        seed=seed,
+        headless=True,
+        llm_requests_per_second=10_000,
+        **options,
+    )
+
+
+def run(model: LaborModel, steps: int) -> dict[str, list]:
+    for _ in range(steps):
+        model.step()
+    return model.datacollector.model_vars
+
+
+def messages(content: str) -> list[dict[str, str]]:
+    return [{"role": "user", "content": content}]
+
+
+def test_concurrent_requests_stay_under_the_cap():
+    responder = StubResponder(latency=0.01)
+    model = llm_model(AsyncStubLLMClient(responder), llm_concurrency=3)
+    run(model, 12)
+    model.close()
+
+    assert responder.max_in_flight == 3
+
+
+def test_concurrent_answers_are_applied_in_company_order():
+    # The stub's random latencies make answers arrive out of order
+    sequential = run(llm_model(StubLLMClient()), 12)
+    concurrent = llm_model(AsyncStubLLMClient(StubResponder(latency=0.01)))
+
+    assert run(concurrent, 12) == sequential
+    concurrent.close()
+
+
+def test_closing_a_model_closes_its_event_loop():
+    model = llm_model(StubLLMClient(), llm_batched=True)
+    run(model, 3)
+    model.close()
+    model.close()
+
+    assert model.llm_engine.loop.is_closed()
+
+
+def test_prompt_cache_evicts_least_recently_used(tmp_path):
+    cache = PromptCache(tmp_path / "cache.sqlite", max_entries=3)
+    for answer in "abc":
+        cache.put("model", messages(answer), answer)
+    cache.put("model", messages("a"), "again")
+    assert cache.get("model", messages("a")) == "a"
+    cache.put("model", messages("d"), "d")
+
+    assert len(cache) == cache.entries == 3
+    assert cache.get("model", messages("b")) is None
+    assert cache.get("model", messages("a")) == "a"
+    assert cache.get("other model", messages("a")) is None
+    assert PromptCache(tmp_path / "cache.sqlite").entries == 3
+
+
+def test_replaying_cache_raises_on_unrecorded_prompts(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        PromptCache(tmp_path / "missing.sqlite", replay=True)
+
+    PromptCache(tmp_path / "cache.sqlite").put("model", messages("a"), "a")
+    cache = PromptCache(tmp_path / "cache.sqlite", replay=True)
+    assert cache.get("model", messages("a")) == "a"
+    with pytest.raises(ReplayMiss):
+        cache.get("model", messages("b"))
+
+
+@pytest.mark.parametrize("client", [StubLLMClient, AsyncStubLLMClient])
+def test_replay_repeats_a_recorded_run_offline(tmp_path, client):
+    path = tmp_path / "cache.sqlite"
+    recorded = run(llm_model(client(), llm_cache=PromptCache(path)), 30)
+    cache = PromptCache(path, replay=True)
+    replayed = run(llm_model(None, llm_cache=cache), 30)
+
+    assert replayed == recorded
+    assert cache.misses == 0
+
+
+def test_diverged_replay_fails_loudly(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    run(llm_model(AsyncStubLLMClient(), llm_cache=PromptCache(path)), 10)
+
+    with pytest.raises(ReplayMiss):
+        run(llm_model(None, seed=4, llm_cache=PromptCache(path, replay=True)), 10)
+
+
+def test_sync_and_async_batched_runs_match():
+    synchronous = run(llm_model(StubLLMClient(), llm_batched=True), 20)
+    asynchronous = run(llm_model(AsyncStubLLMClient(), llm_batched=True), 20)
+
+    assert synchronous == asynchronous
+
+
+def test_batched_answers_skip_unknown_and_malformed_entries():
+    # Wrapped in a code block, with a "#2" id, an invalid decision and a
+    # company that was not asked about
+    answer = '```json\n[{"company": 1, "decision": "Hire"}, {"company": "#2", "decision": "Fire."}, {"company": 3, "decision": "Maybe"}, {"company": 9, "decision": "Fire"}]\n```'
+
+    assert parse_employee_counts(answer, {1, 2, 3}) == {1: Decision.HIRE, 2: Decision.FIRE}
+
+
+def test_batched_decisions_count_one_outcome_each(monkeypatch):
+    # Entries missing from malformed batched answers are asked again one by
+    # one, which must not count as a second outcome
+    decisions = 0
+
+    def counted(method):
+        def wrapper(*args):
+            nonlocal decisions
+            decisions += 1
+            return method(*args)
+
+        return wrapper
+
+    for name in ("_employment_decision_from", "_hire_chosen_application", "_fire_chosen_employee"):
+        monkeypatch.setattr(CompanyLLMAgent, name, counted(getattr(CompanyLLMAgent, name)))
+    model = llm_model(AsyncStubLLMClient(StubResponder(malformed_rate=0.5)), llm_batched=True)
+    run(model, 20)
+
+    assert model.llm_engine is not None
+    assert sum(company.parses_succeeded + company.parses_failed for company in model.companies) == decisions
+
+
+def test_llm_checkpoint_restores_an_identical_run(tmp_path):
+    uninterrupted = run(llm_model(AsyncStubLLMClient()), 30)
+
+    model = llm_model(AsyncStubLLMClient())
+    run(model, 10)
+    save_checkpoint(model, tmp_path / "model.ckpt")
+    restored = load_checkpoint(tmp_path / "model.ckpt", AsyncStubLLMClient())
+
+    assert run(restored, 20) == uninterrupted
@@ -0,0 +1,131 @@
+from collections import Counter
+import random
+
+import numpy as np
+import pytest
+
+from labor_model.checkpoint import load_checkpoint, save_checkpoint
+from labor_model.employee_agent import (LEAVE_PROBABILITY_TABLE, EmployeeAgent,
+                                        leave_probabilities,
+                                        leave_probability_f)
+from labor_model.model import LaborModel
+
+
+def run(model: LaborModel, steps: int) -> dict[str, list]:
+    for _ in range(steps):
+        model.step()
+    return model.datacollector.model_vars
+
+
+def test_leave_probability_table_matches_the_pdf():
+    months = np.arange(1500)
+
+    assert leave_probabilities(months[:1200]).tolist() == leave_probability_f.pdf(months[:1200]).tolist()
+    assert leave_probabilities(months[1200:]) == pytest.approx(leave_probability_f.pdf(months[1200:]), abs=1e-12)
+    assert LEAVE_PROBABILITY_TABLE[-1] < 1e-12
+
+
+def test_batched_quits_match_the_per_employee_draw(settings):
+    model = LaborModel(95, 9, settings, seed=1)
+    # Long enough for a spread of times in state
+    run(model, 24)
+    working = [employee for employee in model.employees if employee.is_working]
+    # What every employee drew on its own before quits were batched
+    probabilities = np.array(
+        [leave_probability_f.pdf(employee.time_in_state) * model.quitting_multiplier for employee in working]
+    )
+
+    trials = 4000
+    quits = Counter()
+    for _ in range(trials):
+        model._decide_quits()
+        quits.update(model.leaving_employees)
+    frequencies = np.array([quits[employee] / trials for employee in working])
+
+    tolerance = 5 * np.sqrt(probabilities * (1 - probabilities) / trials) + 1e-3
+    assert np.all(np.abs(frequencies - probabilities) <= tolerance)
+    uniforms = random.Random(0)
+    per_employee_quits = sum(uniforms.random() < probability for _ in range(trials) for probability in probabilities)
+    assert sum(quits.values()) == pytest.approx(per_employee_quits, rel=0.05)
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_checked_totals_do_not_change_runs(settings, vectorized):
+    unchecked = run(LaborModel(95, 9, settings, seed=3, vectorized=vectorized), 60)
+    checked = run(LaborModel(95, 9, settings, seed=3, vectorized=vectorized, check_totals=True), 60)
+
+    assert checked == unchecked
+
+
+def move_by_neighborhood_queries(employee: EmployeeAgent):
+    # EmployeeAgent.move before company neighborhoods were precomputed
+    grid = employee.model.grid
+    employer = employee.model.companies_by_id.get(employee.employer_id)
+    if employer:
+        possible_steps = grid.get_neighborhood(employer.pos, moore=True, include_center=False, radius=1)
+        more_steps = grid.get_neighborhood(employer.pos, moore=True, include_center=False, radius=2)
+        if employee.pos not in possible_steps and employee.pos not in more_steps:
+            for position in [*possible_steps, *more_steps]:
+                if grid.is_cell_empty(position):
+                    grid.move_agent(employee, position)
+                    return
+
+
+def test_move_targets_list_the_nearest_cells_first(settings):
+    model = LaborModel(95, 9, settings, seed=3)
+    for company in model.companies:
+        nearest = model.grid.get_neighborhood(company.pos, moore=True, include_center=False, radius=1)
+        nearby = model.grid.get_neighborhood(company.pos, moore=True, include_center=False, radius=2)
+
+        assert company.move_targets[: len(nearest)] == list(nearest)
+        assert sorted(company.move_targets) == sorted(set(nearby))
+        assert company.nearby_cells == set(nearby)
+
+
+def test_settled_employees_end_where_neighborhood_queries_put_them(settings, monkeypatch):
+    model = LaborModel(95, 9, settings, seed=3)
+    run(model, 60)
+    for employee in model.employees:
+        if employee.settled:
+            assert employee.pos in model.companies_by_id[employee.employer_id].nearby_cells
+
+    monkeypatch.setattr(EmployeeAgent, "move", move_by_neighborhood_queries)
+    queried = LaborModel(95, 9, settings, seed=3)
+    run(queried, 60)
+    assert [employee.pos for employee in queried.employees] == [employee.pos for employee in model.employees]
+
+
+def test_headless_runs_match_rendered_runs(settings):
+    rendered = run(LaborModel(95, 9, settings, seed=3, headless=False), 60)
+    headless = run(LaborModel(95, 9, settings, seed=3, headless=True), 60)
+
+    assert headless == rendered
+
+
+def test_profiled_runs_match_plain_runs(settings):
+    plain = run(LaborModel(95, 9, settings, seed=2), 30)
+    model = LaborModel(95, 9, settings, seed=2, profile=True)
+
+    assert run(model, 30) == plain
+    assert {"EmployeeAgent", "CompanyAgent", "decide_quits", "data_collection"} <= model.profiler.seconds.keys()
+
+
+def test_equal_seeds_give_equal_runs(settings):
+    first = run(LaborModel(95, 9, settings, seed=7), 60)
+    second = run(LaborModel(95, 9, settings, seed=7), 60)
+    other = run(LaborModel(95, 9, settings, seed=8), 60)
+
+    assert first == second
+    assert first != other
+
+
+@pytest.mark.parametrize("options", [{}, {"vectorized": True}, {"headless": False}])
+def test_checkpoint_restores_an_identical_run(settings, tmp_path, options):
+    uninterrupted = run(LaborModel(200, 9, settings, seed=5, **options), 50)
+
+    model = LaborModel(200, 9, settings, seed=5, **options)
+    run(model, 20)
+    save_checkpoint(model, tmp_path / "model.ckpt")
+    restored = load_checkpoint(tmp_path / "model.ckpt")
+
+    assert run(restored, 30) == uninterrupted